@@ -23,5 +23,5 @@ class ExecutingServiceConfigurator:
         return True
 
 
-    def config(self, node, service_definition, service_to_dns):
+    def config(self, node, service_definition, service_to_dns, journal=None):
         node.run_command(service_definition.execute)
\ No newline at end of file
@@ -17,7 +17,7 @@ class FakeServiceConfigurator:
     def validate(self, service_name, service_definition, abs_path_to_conf, error_list):
         pass
 
-    def config(self, node, service_definition, settings):
+    def config(self, node, service_definition, settings, journal=None):
         def prepare_node():
             node.run_command('running')
             node.upload_file('settings-' + str(settings))
@@ -12,7 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
+import hashlib
 import os
+from phoenix import launch_journal
+from phoenix.launch_journal import NoJournal
 from phoenix.plogging import logger
 
 class PuppetServiceConfigurator:
@@ -48,19 +52,34 @@ class PuppetServiceConfigurator:
         return True
 
 
-    def config(self, node, service_definition, service_to_dns):
-        ConfigureService(node, service_definition, service_to_dns).configure()
+    def config(self, node, service_definition, service_to_dns, journal=None):
+        ConfigureService(node, service_definition, service_to_dns, journal).configure()
 
 class ConfigureService():
 
-    def __init__(self, node, service_definition, service_to_dns):
+    def __init__(self, node, service_definition, service_to_dns, journal=None):
         self.node = node
         self.service_definition = service_definition
         self.service_to_dns = service_to_dns
+        self.journal = journal or NoJournal()
 
     def configure(self):
-        self._bootstrap_puppet()
-        self._upload_artifacts()
+        if not self.journal.completed(self.node.id(), launch_journal.BOOTSTRAPPED):
+            self._bootstrap_puppet()
+            self.journal.record(self.node.id(), launch_journal.BOOTSTRAPPED)
+
+        tar_file = self._bundle()
+        try:
+            # A launch is often resumed because the puppet code was fixed, so a changed bundle is uploaded again
+            checksum = _checksum(tar_file)
+            if not self.journal.completed(self.node.id(), launch_journal.BUNDLE_UPLOADED, self.service_definition.name, checksum):
+                self._upload_artifacts(tar_file)
+                self.journal.record(self.node.id(), launch_journal.BUNDLE_UPLOADED, self.service_definition.name,
+                    checksum=checksum)
+        finally:
+            # Bundles are per node, so they would pile up in /tmp launch after launch
+            os.remove(tar_file)
+
         self._configure_service()
 
     def _bootstrap_puppet(self):
@@ -72,9 +91,13 @@ class ConfigureService():
             logger.debug("Bootstrapping puppet")
             self.node.run_command('sudo apt-get update && sudo apt-get install puppet -y')
 
-    def _upload_artifacts(self):
+    def _bundle(self):
+        # Several nodes may be configured at once, so each gets its own bundle
+        return self.service_definition.bundle("puppet_module_directory",
+            "%s_%s_puppet_bundle.tgz" % (self.service_definition.name, self.node.id()))
+
+    def _upload_artifacts(self, tar_file):
         logger.debug('Uploading artifacts')
-        tar_file = self.service_definition.bundle("puppet_module_directory", "%s_puppet_bundle.tgz" % self.service_definition.name)
         self.node.upload_file(tar_file, "/tmp")
         remote_tarfile_path = "/tmp/%s" % os.path.basename(tar_file)
         self.node.run_command('tar xvfz %s' % remote_tarfile_path)
@@ -88,3 +111,11 @@ class ConfigureService():
         command_to_run = "sudo %s puppet apply --modulepath=puppet %s" % (facter_settings, puppet_manifest)
         print command_to_run
         self.node.run_command(command_to_run)
+
+def _checksum(tar_file):
+    # Of the tar inside, as gzip may stamp the time into an otherwise unchanged bundle
+    bundle = gzip.open(tar_file, 'rb')
+    try:
+        return hashlib.md5(bundle.read()).hexdigest()
+    finally:
+        bundle.close()
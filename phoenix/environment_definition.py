@@ -12,14 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import chain
+from functools import partial
+import threading
 
 import yaml
+from phoenix import launch_journal
+from phoenix.inventory import InventorySnapshot
+from phoenix.launch_journal import LaunchJournal
 from phoenix.plogging import logger
 from phoenix.node_config import node_definition_from_map
-from phoenix.providers import node_predicates
 from phoenix.providers.noop_provider import NoopNodeProvider
 from phoenix.utilities.utility import get_class_from_fully_qualified_string
+from phoenix.service_definition import service_dependencies
+from phoenix.utilities.worker_pool import WorkerPool, call_in_subprocess, find_cycle, raise_on_failures
 import providers as providers
 
 def _provider(env_values, all_credentials):
@@ -100,7 +107,8 @@ def _validate_environment_definitions(definition_data, error_list, all_credentia
 
     raise Exception(error_string)
 
-def environment_definitions_from_yaml(yaml_string, service_definitions=None, env_name=None, all_credentials=None, noop=False):
+def environment_definitions_from_yaml(yaml_string, service_definitions=None, env_name=None, all_credentials=None, noop=False,
+                                      all_regions=False):
     definition_data = yaml.load(yaml_string)
     definition_map = {}
 
@@ -114,6 +122,8 @@ def environment_definitions_from_yaml(yaml_string, service_definitions=None, env
             node_defs.append(node_definition_from_map(node_def_as_map, all_credentials))
 
         node_provider = _provider(env_values, all_credentials)
+        if not all_regions:
+            node_provider.limit_to_regions_of(node_defs)
         if noop:
             node_provider = NoopNodeProvider(node_provider)
 
@@ -144,6 +154,8 @@ class EnvironmentDefinition:
         self.node_definitions = node_definitions
         self.env_def_name = env_def_name
         self.service_lifecycle_hooks = service_lifecycle_hooks
+        self.journal = LaunchJournal()
+        self.inventory = InventorySnapshot(node_provider, all_credentials, name, env_def_name)
 
     def __repr__(self):
         return self.name.__repr__()
@@ -152,8 +164,14 @@ class EnvironmentDefinition:
         return self.node_provider
 
     def _block_until_all_nodes_are_ready(self, provisioned_nodes):
-        for node in provisioned_nodes:
-            node.wait_for_ready(lambda: None, self.node_provider.get_node_startup_timeout())
+        # Every node is watched at the same time, so this takes as long as the slowest node rather than the sum of them.
+        # Returns a map of node -> TaskOutcome, a failed outcome holds the reason that node never became ready
+        outcomes = WorkerPool(len(provisioned_nodes)).map(self._wait_for_node, provisioned_nodes)
+        return dict(zip(provisioned_nodes, outcomes))
+
+    def _wait_for_node(self, node):
+        node.wait_for_ready(lambda: None, self.node_provider.get_node_startup_timeout())
+        self.journal.record(node.id(), launch_journal.READY)
 
     def build_environment_settings(self, service_to_nodes):
         env_settings = defaultdict(lambda: [])
@@ -165,10 +183,70 @@ class EnvironmentDefinition:
         return dict(env_settings)
 
     def configure_services(self, service_to_nodes, env_settings):
-        for service_name, running_nodes in service_to_nodes.items():
-            for running_node in running_nodes:
-                self.service_definitions[service_name].apply_on(running_node, {"settings": env_settings})
-                self.fire_service_installed(service_name, running_node)
+        # A service is only configured once every service it talks to has been configured on all of its nodes, while
+        # independent services and nodes are configured concurrently, up to the provider's concurrency limit. Each node
+        # only has one service applied to it at a time.
+        service_names = self._services_in_dependency_order([s for s, nodes in service_to_nodes.items() if nodes])
+        dependencies_between_services = service_dependencies(self.service_definitions)
+        concurrency_limit = self.node_provider.get_concurrency_limit()
+
+        tasks = []
+        dependencies = defaultdict(lambda: [])
+        last_task_on_node = {}
+        for service_name in service_names:
+            for running_node in service_to_nodes[service_name]:
+                key = (service_name, running_node.id())
+                tasks.append((key, partial(self._configure_service_on_node, service_name, running_node, env_settings,
+                    concurrency_limit > 1)))
+
+                for dependency in dependencies_between_services[service_name]:
+                    dependencies[key].extend([(dependency, n.id()) for n in service_to_nodes.get(dependency, [])])
+                if running_node.id() in last_task_on_node:
+                    dependencies[key].append(last_task_on_node[running_node.id()])
+                last_task_on_node[running_node.id()] = key
+
+        outcomes = WorkerPool(concurrency_limit).run(tasks, dependencies)
+        raise_on_failures(dict(("Service %s on node %s" % key, outcome) for key, outcome in outcomes.items()),
+            "Unable to configure all services")
+
+    def _check_service_dependencies(self, service_names):
+        cycle = find_cycle(sorted(service_names), service_dependencies(self.service_definitions))
+        if cycle:
+            raise StandardError("Services have cyclic dependencies through their connectivity: %s" % " -> ".join(cycle))
+
+    def _services_in_dependency_order(self, service_names):
+        dependencies = service_dependencies(self.service_definitions)
+        self._check_service_dependencies(service_names)
+
+        ordered = []
+        def visit(service_name):
+            if service_name in ordered or not service_name in service_names:
+                return
+            for dependency in sorted(dependencies[service_name]):
+                visit(dependency)
+            ordered.append(service_name)
+
+        for service_name in service_names:
+            visit(service_name)
+        return ordered
+
+    def _configure_service_on_node(self, service_name, running_node, env_settings, in_subprocess):
+        if self.journal.completed(running_node.id(), launch_journal.APPLIED, service_name):
+            logger.info("Service %s has already been applied to node %s" % (service_name, running_node.id()))
+            return
+
+        service_definition = self.service_definitions[service_name]
+        if in_subprocess:
+            # Another thread may hold the journal's lock as we fork, so the child hands its steps back to record here
+            deferred_journal = self.journal.deferred()
+            def apply_service():
+                service_definition.apply_on(running_node, {"settings": env_settings}, journal=deferred_journal)
+                return deferred_journal.entries
+            self.journal.record_all(call_in_subprocess(apply_service))
+        else:
+            service_definition.apply_on(running_node, {"settings": env_settings}, journal=self.journal)
+        self.fire_service_installed(service_name, running_node)
+        self.journal.record(running_node.id(), launch_journal.APPLIED, service_name)
 
     def fire_service_installed(self, service_name, node):
         if service_name in self.service_lifecycle_hooks.keys():
@@ -185,28 +263,83 @@ class EnvironmentDefinition:
                     hook.service_terminated(service_name, node)
 
     def _provision_node(self, node_definition):
-        return self.node_provider.start(node_definition, self.name, self.env_def_name)
+        return self._provision_batch([node_definition])[0]
+
+    def _provision_batch(self, node_definitions):
+        running_nodes = self.node_provider.start_batch(node_definitions, self.name, self.env_def_name)
+        for node_definition, running_node in zip(node_definitions, running_nodes):
+            self.inventory.node_started(running_node)
+            self.journal.record(running_node.id(), launch_journal.PROVISIONED, definition=self._position_of(node_definition),
+                services=node_definition.services)
+        return running_nodes
+
+    def _launch_batches(self, node_defs):
+        # Groups the node definitions the provider can start together, in the order they are first defined
+        batches = []
+        batches_by_key = {}
+        for node_def in node_defs:
+            key = self.node_provider.launch_batch_key(node_def)
+            if key is None:
+                batches.append([node_def])
+            elif key in batches_by_key:
+                batches_by_key[key].append(node_def)
+            else:
+                batches_by_key[key] = [node_def]
+                batches.append(batches_by_key[key])
+        return batches
+
+    def _position_of(self, node_definition):
+        positions = [i for i, d in enumerate(self.node_definitions or []) if d is node_definition]
+        return positions[0] if positions else None
 
     def _provision_nodes(self, node_defs, blocking=False):
         # Takes a list of node definitions, returning a map of service name -> node
 
+        # Identical nodes are started together where the provider can, and batches are started concurrently, up to
+        # the provider's concurrency limit
         running_nodes = []
         service_to_nodes = defaultdict(lambda: [])
 
+        batches = self._launch_batches(node_defs)
+        outcomes = WorkerPool(self.node_provider.get_concurrency_limit()).map(self._provision_batch, batches)
+
+        def describe(batch):
+            numbers = [str(i + 1) for i, node_def in enumerate(node_defs) if any(node_def is d for d in batch)]
+            return "Node definition%s %s (%s)" % ("s" if len(batch) > 1 else "", ", ".join(numbers), batch[0])
+        raise_on_failures(dict((describe(batch), outcome) for batch, outcome in zip(batches, outcomes)),
+            "Unable to start all nodes")
+
+        started = {}
+        for batch, outcome in zip(batches, outcomes):
+            for node_def, running_node in zip(batch, outcome.result):
+                started[id(node_def)] = running_node
+
         for node_def in node_defs:
-            running_node = self._provision_node(node_def)
+            running_node = started[id(node_def)]
             running_nodes.append(running_node)
 
             for service in node_def.services:
                 service_to_nodes[service].append(running_node)
 
         if blocking:
-            self._block_until_all_nodes_are_ready(running_nodes)
+            readiness = self._block_until_all_nodes_are_ready(running_nodes)
+            raise_on_failures(dict(("Node %s" % node.id(), outcome) for node, outcome in readiness.items()),
+                "Not all nodes became ready")
 
         return dict(service_to_nodes)
 
     def list_nodes(self):
-        return self.node_provider.list(self.all_credentials, lambda x: node_predicates.running_in_env(self.name, self.env_def_name)(x))
+        return self.inventory.nodes()
+
+    def _shutdown_node(self, node):
+        self._shutdown_nodes([node])
+
+    def _shutdown_nodes(self, nodes):
+        if not nodes:
+            return
+        self.node_provider.shutdown_nodes(nodes)
+        for node in nodes:
+            self.inventory.node_shutdown(node.id())
 
     def delta_defs_with_running_nodes(self, node_definitions):
         # Given a list of node definitions, determines if a running node matches. If so,
@@ -216,24 +349,46 @@ class EnvironmentDefinition:
         pre_existing_nodes = defaultdict(lambda: set())
         node_defs_to_provision = []
 
-        nodes_in_environment = self.node_provider.list(self.all_credentials, lambda x: node_predicates.running_in_env(self.name, self.env_def_name)(x))
-
-        for node_def in node_definitions:
-            matching_running_node = next((n for n in nodes_in_environment if n.matches_definition(node_def)), None)
+        nodes_in_environment = self.list_nodes()
+
+        # When resuming a launch, nodes it started go back to the definitions they were started for, however far
+        # through being tagged they got
+        resumed_nodes = {}
+        for node in nodes_in_environment:
+            provisioned_for = self.journal.provisioned_definition(node.id())
+            if provisioned_for:
+                position, services = provisioned_for
+                if position is not None and position < len(node_definitions) and \
+                   sorted(node_definitions[position].services) == sorted(services) and not position in resumed_nodes:
+                    resumed_nodes[position] = node
+
+        # Each node is reduced to a fingerprint once, so a definition is matched with a lookup rather than by
+        # comparing it against every node. Nodes sharing a fingerprint are handed out in the order they were listed.
+        resumed_node_ids = set(n.id() for n in resumed_nodes.values())
+        nodes_by_fingerprint = defaultdict(lambda: deque())
+        for node in nodes_in_environment:
+            if not node.id() in resumed_node_ids:
+                nodes_by_fingerprint[node.fingerprint()].append(node)
+
+        matched_node_ids = set()
+        for position, node_def in enumerate(node_definitions):
+            if position in resumed_nodes:
+                matching_running_node = resumed_nodes[position]
+            else:
+                candidates = nodes_by_fingerprint.get(self.node_provider.definition_fingerprint(node_def))
+                matching_running_node = candidates.popleft() if candidates else None
 
             if matching_running_node:
                 for service in node_def.services:
                     pre_existing_nodes[service].add(matching_running_node)
 
                 # We don't want to match the same node again!
-                nodes_in_environment.remove(matching_running_node)
+                matched_node_ids.add(matching_running_node.id())
             else:
                 node_defs_to_provision.append(node_def)
 
-        # At this point, if there are any nodes still in 'nodes_in_environment' then they haven't matched, and need
-        # therefore to be terminated
-        nodes_to_terminate = []
-        nodes_to_terminate.extend(nodes_in_environment)
+        # Any nodes which haven't matched a definition are no longer needed, and therefore need to be terminated
+        nodes_to_terminate = [n for n in nodes_in_environment if not n.id() in matched_node_ids]
 
         return node_defs_to_provision, pre_existing_nodes, nodes_to_terminate
 
@@ -244,7 +399,14 @@ class EnvironmentDefinition:
             services_to_all_running_nodes[service_name].extend(services_to_newly_launched_nodes.get(service_name, []))
         return services_to_all_running_nodes
 
-    def launch(self):
+    def launch(self, pipelined=False, journal=None):
+        # journal: LaunchJournal to record progress in, and to skip steps already recorded when resuming a launch
+        if journal:
+            self.journal = journal
+
+        # Checked before anything is started, as services with cyclic dependencies could never be configured
+        self._check_service_dependencies(set(chain.from_iterable(node_def.services for node_def in self.node_definitions)))
+
         node_defs_to_provision, services_to_already_launched_nodes, running_nodes_to_terminate = self.delta_defs_with_running_nodes(
             self.node_definitions)
 
@@ -254,9 +416,22 @@ class EnvironmentDefinition:
         # TODO - Should log gracefully during lifecycle events....
         logger.info("Shutting down instances %s" % [n.id() for n in running_nodes_to_terminate])
         logger.info("Launching new instances %s" % node_defs_to_provision)
+        self.node_provider.check_node_definitions(node_defs_to_provision)
+
+        if pipelined:
+            self._launch_pipelined(node_defs_to_provision, services_to_already_launched_nodes, running_nodes_to_terminate)
+            self.journal.finish()
+            return
 
         services_to_newly_launched_nodes = self._provision_nodes(node_defs_to_provision, blocking=True)
-        map(lambda n: self.node_provider.shutdown(n.id()), running_nodes_to_terminate)
+
+        resumed_nodes_to_wait_for = [n for n in set(chain.from_iterable(services_to_already_launched_nodes.values()))
+                                     if self.journal.started_but_not_ready(n.id())]
+        readiness = self._block_until_all_nodes_are_ready(resumed_nodes_to_wait_for)
+        raise_on_failures(dict(("Node %s" % node.id(), outcome) for node, outcome in readiness.items()),
+            "Not all nodes became ready")
+
+        self._shutdown_nodes(running_nodes_to_terminate)
 
         services_to_all_running_nodes = self.merge_service_to_nodes_dicts(services_to_already_launched_nodes,
             services_to_newly_launched_nodes)
@@ -266,17 +441,133 @@ class EnvironmentDefinition:
         env_settings = self.build_environment_settings(services_to_all_running_nodes)
         logger.debug("settings: %s" % env_settings)
         self.configure_services(services_to_all_running_nodes, env_settings)
+        self.journal.finish()
+
+    def _launch_pipelined(self, node_defs_to_provision, services_to_already_launched_nodes, running_nodes_to_terminate):
+        # Each node goes through start -> ready -> tag -> configure on its own, so a slow node only holds up the services
+        # which talk to services on it, and a node which fails only stops its own services and their dependents.
+        # Waiting for nodes is unbounded, while starting, tagging and configuring share the provider's concurrency limit.
+        # A service's settings hold every node of the services it depends on, as in a normal launch, but only the nodes
+        # of its own service which are already up. A service with wait_for_whole_service set, such as a cluster whose
+        # members have to know each other, is only configured once all of its nodes are up, so one slow node holds up
+        # the rest of the service.
+        concurrency_limit = self.node_provider.get_concurrency_limit()
+        provider_slots = threading.BoundedSemaphore(concurrency_limit)
+        dependencies_between_services = service_dependencies(self.service_definitions)
+
+        # A slot is somewhere a node will be - a node definition still to start, or a node which is already running
+        slots = [(('new', index), node_def, node_def.services) for index, node_def in enumerate(node_defs_to_provision)]
+        services_on_running_nodes = defaultdict(lambda: [])
+        running_nodes = {}
+        for service_name, nodes in services_to_already_launched_nodes.items():
+            for node in nodes:
+                services_on_running_nodes[node.id()].append(service_name)
+                running_nodes[node.id()] = node
+        slots.extend([(('running', node_id), running_nodes[node_id], services) for node_id, services in services_on_running_nodes.items()])
+
+        nodes = {}
+        # Slots whose node is ready and tagged
+        up_slots = set()
+        slots_by_service = defaultdict(lambda: [])
+        for slot, _, services in slots:
+            for service_name in services:
+                slots_by_service[service_name].append(slot)
+        self._services_in_dependency_order(slots_by_service.keys())
+
+        def bring_up(slot, node_def):
+            with provider_slots:
+                nodes[slot] = self._provision_node(node_def)
+            self._wait_for_node(nodes[slot])
+            with provider_slots:
+                self.tag_nodes_with_services(dict((s, [nodes[slot]]) for s in node_def.services))
+            up_slots.add(slot)
+
+        def retag(slot, node, services):
+            nodes[slot] = node
+            if self.journal.started_but_not_ready(node.id()):
+                self._wait_for_node(node)
+            with provider_slots:
+                self.tag_nodes_with_services(dict((s, [node]) for s in services))
+            up_slots.add(slot)
+
+        def configure(service_name, slot):
+            services_to_nodes = {service_name: [nodes[s] for s in slots_by_service[service_name] if s in up_slots]}
+            for dependency in dependencies_between_services[service_name]:
+                if slots_by_service[dependency]:
+                    services_to_nodes[dependency] = [nodes[s] for s in slots_by_service[dependency]]
+            with provider_slots:
+                self._configure_service_on_node(service_name, nodes[slot], self.build_environment_settings(services_to_nodes),
+                    concurrency_limit > 1)
+
+        def terminate(node):
+            with provider_slots:
+                self._shutdown_node(node)
+
+        tasks = []
+        dependencies = defaultdict(lambda: [])
+        for slot, node_or_def, services in slots:
+            if slot[0] == 'new':
+                tasks.append((slot, partial(bring_up, slot, node_or_def)))
+            else:
+                tasks.append((slot, partial(retag, slot, node_or_def, services)))
+
+            previous_task_on_node = slot
+            for service_name in self._services_in_dependency_order(services):
+                key = (service_name, slot)
+                tasks.append((key, partial(configure, service_name, slot)))
+                dependencies[key].append(previous_task_on_node)
+                if self.service_definitions[service_name].configuration.get('wait_for_whole_service', False):
+                    dependencies[key].extend(slots_by_service[service_name])
+                for dependency in dependencies_between_services[service_name]:
+                    dependencies[key].extend([(dependency, s) for s in slots_by_service[dependency]])
+                previous_task_on_node = key
+
+        # As with a normal launch, nodes which are no longer needed go once their replacements are up
+        for node in running_nodes_to_terminate:
+            key = ('terminate', node.id())
+            tasks.append((key, partial(terminate, node)))
+            dependencies[key].extend([slot for slot, _, _ in slots])
+
+        def describe(key):
+            if isinstance(key[1], tuple):
+                return "Service %s on %s" % (key[0], describe(key[1]))
+            elif key[0] == 'new':
+                return "node definition %s (%s)" % (key[1] + 1, node_defs_to_provision[key[1]])
+            elif key[0] == 'running':
+                return "node %s" % key[1]
+            return "Terminating node %s" % key[1]
+
+        outcomes = WorkerPool(len(tasks)).run(tasks, dependencies)
+        raise_on_failures(dict((describe(key), outcome) for key, outcome in outcomes.items()), "Unable to launch all of the environment")
 
     def terminate_all(self):
         self.terminate_nodes([x for x in self.list_nodes()])
 
     def terminate_nodes(self, nodes_to_eliminate):
-        for node in nodes_to_eliminate:
-            self.node_provider.shutdown(node.id())
-            for service_name in node.get_services().keys():
-                self.fire_service_terminated(service_name,node)
+        # The services are read before the nodes go, then the nodes are shut down together and their hooks run
+        # side by side, up to the provider's concurrency limit as hooks may call its APIs too
+        terminated_services = [(service_name, node) for node in nodes_to_eliminate for service_name in node.get_services().keys()]
+        self._shutdown_nodes(nodes_to_eliminate)
+
+        hook_workers = min(len(terminated_services), self.node_provider.get_concurrency_limit())
+        outcomes = WorkerPool(hook_workers).run([((service_name, node.id()), partial(self.fire_service_terminated, service_name, node))
+                                                             for service_name, node in terminated_services])
+        raise_on_failures(outcomes, "Unable to run all service terminated hooks")
 
     def tag_nodes_with_services(self, services_to_running_nodes):
+        tagged = []
         for service_name, running_nodes in services_to_running_nodes.items():
-            map(lambda n: n.add_service_to_tags(service_name, self.service_definitions[service_name].connectivity),
-                running_nodes)
\ No newline at end of file
+            for running_node in running_nodes:
+                if not self.journal.completed(running_node.id(), launch_journal.TAGGED, service_name):
+                    running_node.add_service_to_tags(service_name, self.service_definitions[service_name].connectivity)
+                    tagged.append((running_node, service_name))
+
+        # Providers may hold tag writes back until every service has been added, to write them in bulk
+        tagged_nodes = []
+        for running_node, _ in tagged:
+            if not any(running_node is n for n in tagged_nodes):
+                tagged_nodes.append(running_node)
+        self.node_provider.flush_tags(tagged_nodes)
+
+        for running_node, service_name in tagged:
+            self.journal.record(running_node.id(), launch_journal.TAGGED, service_name)
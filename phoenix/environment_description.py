@@ -98,37 +98,59 @@ class LXCEnvironmentDefinitionTranslator(object):
             nodes.append(Node({'template': node_defn.template,'services': service_descriptions(node_defn, service_definitions)}))
         return EnvironmentDescription(name, [Location(env_definition.node_provider.host_name, nodes)])
 
+def stream_table(header, rows, widths):
+    """
+    Yields the lines of a Texttable drawing of the rows, drawing each row as it arrives so a long listing can be
+    printed before it is complete. The columns have fixed widths, as rows still to come can't widen those printed.
+    """
+    heading = Texttable()
+    heading.set_cols_width(widths)
+    heading.header(header)
+    # The top border, the header and the line beneath it
+    heading_lines = heading.draw().split('\n')
+    for line in heading_lines[:3]:
+        yield line
+
+    drawn_rows = False
+    for row in rows:
+        body = Texttable()
+        body.set_cols_width(widths)
+        body.add_row(row)
+        # Each row brings its own bottom border, so its top border is the line above it
+        for line in body.draw().split('\n')[1:]:
+            yield line
+        drawn_rows = True
+
+    if not drawn_rows:
+        yield heading_lines[0]
+
 class SimpleTextEnvironmentDescriber():
     def describe(self, environment):
-        description = environment.get_name() + '\n'
+        return "".join(self.stream(environment))
+
+    def stream(self, environment):
+        yield environment.get_name() + '\n'
 
         for location in environment.get_locations():
-            description += '  ' + location.get_name() + '\n'
+            yield '  ' + location.get_name() + '\n'
 
             for node in location.get_nodes():
-                description += '    DNS: ' + node.attributes()['dns_name'] + ' Services:'
+                description = '    DNS: ' + node.attributes()['dns_name'] + ' Services:'
                 services = node.attributes()['services']
                 for service_name in services.keys():
                     description += ' ' + service_name
-                description += '\n'
-
-        return description
+                yield description + '\n'
 
 class TextTableEnvironmentDescriber():
 
     def describe(self, environment):
-        description = "\nEnvironment: " + environment.get_name() + '\n'
-
-        table = Texttable()
-        table.set_cols_width([10, 50, 20, 15])
-        rows = [["Location", "DNS", "Services", "ID"]]
+        return "".join(self.stream(environment))
 
-        for location in environment.get_locations():
-
-            for node in location.get_nodes():
-                rows.append([location.get_name(), node.attributes()['dns_name'], node.attributes()['services'], node.attributes()['id']])
+    def stream(self, environment):
+        yield "\nEnvironment: " + environment.get_name() + '\n'
 
-        table.add_rows(rows)
-        description += table.draw()
+        rows = ([location.get_name(), node.attributes()['dns_name'], node.attributes()['services'], node.attributes()['id']]
+                for location in environment.get_locations() for node in location.get_nodes())
 
-        return description
\ No newline at end of file
+        for number, line in enumerate(stream_table(["Location", "DNS", "Services", "ID"], rows, [10, 50, 20, 15])):
+            yield line if number == 0 else '\n' + line
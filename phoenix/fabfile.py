@@ -16,17 +16,20 @@ import ConfigParser
 from functools import partial
 import os
 import os.path as path
+import sys
 from contextlib import contextmanager
 
 from fabric.utils import error
 import pystache
-from texttable import Texttable
 import yaml
 
 from environment_definition import environment_definitions_from_yaml
 from environment_definition import list_environments
-from phoenix.environment_description import SimpleTextEnvironmentDescriber, TextTableEnvironmentDescriber
+from phoenix.inventory import CachedNode, InventoryCache, describe_cached_environment
+from phoenix.launch_journal import LaunchJournal, launch_journal_path
+from phoenix.environment_description import SimpleTextEnvironmentDescriber, TextTableEnvironmentDescriber, stream_table
 from phoenix.plogging import logger
+from phoenix.providers import node_predicates
 from phoenix.templates.templating import copy_template
 from providers.aws_provider import AWSNodeProvider
 import service_definition as service_definitions
@@ -36,6 +39,7 @@ REQUIRED = 'required'
 ACTION = 'action'
 DEFAULT = 'default'
 HELP = 'help'
+TYPE = 'type'
 
 DEFAULT_ENVIRONMENT="../samples"
 
@@ -47,6 +51,16 @@ CONFIG_DIR_OPTION = ('--config_dir',
                          {DEFAULT: DEFAULT_ENVIRONMENT,
                           HELP: 'Runs Phoenix in debug mode, resulting in more detailed logging both from Phoenix as well as echoing all shell commands sent to nodes'})
 
+ALL_REGIONS_OPTION = ('--all-regions', {REQUIRED:False, ACTION:'store_true',
+    HELP:"Look for nodes in every region, rather than only the regions the environment's nodes are defined in. Useful for \
+          finding nodes left behind in regions the environment no longer uses"})
+
+FRESH_OPTION = ('--fresh', {REQUIRED:False, ACTION:'store_true',
+    HELP:"List the running nodes from the provider, rather than answering from the nodes cached by recent commands"})
+
+CACHE_TTL_OPTION = ('--cache_ttl', {DEFAULT:60, TYPE:int,
+    HELP:"How many seconds the running nodes cached by one command can be used to answer later commands. Defaults to 60"})
+
 PROPERTY_FILE_OPTION = ('--property_file',
     {DEFAULT: os.path.join(os.path.abspath("."), "phoenix.ini"),
      HELP: "Location of a properties file in INI format containing values to template in environment configuration. Useful for \
@@ -95,17 +109,52 @@ def generate_skeleton(dest_dir):
         print("Directory %s must exist and be a valid directory" % dest_dir)
 
 
-@cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION)
-def list_nodes_in_environment(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, property_file=None):
+@cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION, ALL_REGIONS_OPTION,
+    FRESH_OPTION, CACHE_TTL_OPTION)
+def list_nodes_in_environment(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, property_file=None, all_regions=False,
+                              fresh=False, cache_ttl=60):
     """Lists nodes in a named environment"""
-    with env_conf_from_dir(config_dir, env_name, property_file) as env_defs:
+    with env_conf_from_dir(config_dir, env_name, property_file, all_regions=all_regions) as env_defs:
         template_ = env_defs[env_template]
-        _render_table(template_.list_nodes())
+        _render_table(iter_running_nodes(config_dir, template_, env_name, env_template, fresh, cache_ttl, all_regions))
+
+
+def _inventory_cache(config_dir, ttl=60):
+    return InventoryCache(os.path.join(config_dir, '.inventory_cache'), ttl)
+
+
+def iter_running_nodes(config_dir, env_def, env_name, env_template, fresh=False, cache_ttl=60, all_regions=False):
+    """
+    Yields the running nodes of an environment as cached by a recent command, listing them from the provider when
+    there are none cached within cache_ttl seconds, or fresh is set. Listed nodes are yielded as the provider
+    produces them, and cached once the listing is complete.
+    all_regions: whether the provider lists every region. Listings of only the environment's regions are cached apart
+    from these, as they can't show nodes left in other regions
+    yields: CachedNode
+    """
+    scope = 'all regions' if all_regions else None
+    cache = _inventory_cache(config_dir, cache_ttl)
+    provider = env_def.get_node_provider()
+    cached_nodes = None if fresh else cache.get(provider, env_template, env_name, scope)
+    if cached_nodes is not None:
+        logger.debug("Using running nodes of %s cached within the last %s seconds" % (env_name, cache_ttl))
+        for cached_node in cached_nodes:
+            yield cached_node
+        return
+
+    listed = []
+    for node in provider.iter_nodes(env_def.all_credentials, node_predicates.running_in_env(env_name, env_template)):
+        cached_node = CachedNode(node, provider.location_of(node))
+        listed.append(cached_node)
+        yield cached_node
+    cache.put(provider, env_template, env_name, listed, scope)
 
 
 def describe_running_environment(config_dir, env_def, env_name, env_template, formatter):
     provider = env_def.get_node_provider()
-    running_env = provider.get_running_environment(env_name, env_template, _credentials_from_path(config_dir))
+    # When the definition was loaded for this running environment its inventory already holds the nodes
+    nodes = env_def.list_nodes() if env_def.name == env_name else None
+    running_env = provider.get_running_environment(env_name, env_template, _credentials_from_path(config_dir), nodes)
     return formatter.describe(running_env)
 
 
@@ -118,19 +167,24 @@ def _describer_for_format(format):
         raise StandardError('Unsupported format %s' % format)
 
 
-@cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION,
+@cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION, ALL_REGIONS_OPTION,
+    FRESH_OPTION, CACHE_TTL_OPTION,
     ("--format", {HELP:"Which format do you want the description in. Defaults to YAML",
                   DEFAULT:"txt",
                   CHOICES:['yaml', 'txt', 'table']}))
-def show_running_environment(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, format=None, property_file=None):
+def show_running_environment(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, format=None, property_file=None,
+                             all_regions=False, fresh=False, cache_ttl=60):
     """Show an environment with its running nodes"""
-    with env_conf_from_dir(config_dir, env_template, property_file) as env_def:
+    with env_conf_from_dir(config_dir, env_template, property_file, all_regions=all_regions) as env_def:
         describer = _describer_for_format(format)
 
         if not env_def.has_key(env_template):
             raise StandardError("Cannot find template %s" % env_template)
 
-        print describe_running_environment(config_dir, env_def[env_template], env_name, env_template, describer)
+        # Nodes are described by location, so the whole environment has to be listed before any of it is printed
+        cached_nodes = list(iter_running_nodes(config_dir, env_def[env_template], env_name, env_template, fresh, cache_ttl,
+            all_regions))
+        _print_stream(describer.stream(describe_cached_environment(env_name, cached_nodes)))
 
 
 @cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, PROPERTY_FILE_OPTION,
@@ -165,24 +219,37 @@ def list_definitions(config_dir=DEFAULT_ENVIRONMENT, property_file=None):
     for env_def in get_list_of_environment_definitions(config_dir, property_file):
         print formatter.describe(env_def)
 
-@cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION)
-def terminate_environment(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, property_file=None):
+@cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION, ALL_REGIONS_OPTION)
+def terminate_environment(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, property_file=None, all_regions=False):
     """Shuts down all nodes associated with a given environment"""
-    with env_conf_from_dir(config_dir,  env_name, property_file) as env_defs:
-        env_defs[env_template].terminate_all() # TODO: let's confirm this shall we?
+    with env_conf_from_dir(config_dir,  env_name, property_file, all_regions=all_regions) as env_defs:
+        try:
+            env_defs[env_template].terminate_all() # TODO: let's confirm this shall we?
+        finally:
+            _inventory_cache(config_dir).invalidate(env_defs[env_template].get_node_provider())
 
 @cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION,
-    RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION,
+    RUNNING_ENVIRONMENT_OPTION, PROPERTY_FILE_OPTION, ALL_REGIONS_OPTION,
     ('--noop', {REQUIRED:False, ACTION:'store_true', HELP:"If no-op is set, then the environment will not be launched or changed, rather Phoenix will report \
-                      on what would be done"}))
-def launch(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, noop=False, property_file=None):
+                      on what would be done"}),
+    ('--pipelined', {REQUIRED:False, ACTION:'store_true', HELP:"Rather than waiting for every node to start before configuring any \
+                      of them, each node is configured as soon as it is ready and the services it talks to are configured"}),
+    ('--resume', {REQUIRED:False, ACTION:'store_true', HELP:"Carry on from where the last launch of this environment failed, \
+                      skipping the steps it had already completed"}))
+def launch(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, noop=False, property_file=None, pipelined=False,
+           resume=False, all_regions=False):
     """Launches a new environment, or applies changes made to an existing environment"""
-    with env_conf_from_dir(config_dir, env_name, property_file, noop=noop) as env_defs:
+    with env_conf_from_dir(config_dir, env_name, property_file, noop=noop, all_regions=all_regions) as env_defs:
         if noop:
             logger.info("Running in NOOP mode - no changes will be made to your system")
 
         environment_definition = env_defs[env_template]
-        environment_definition.launch()
+        journal = None if noop else LaunchJournal(launch_journal_path(config_dir, env_template, env_name), resume=resume)
+        try:
+            environment_definition.launch(pipelined=pipelined, journal=journal)
+        finally:
+            if not noop:
+                _inventory_cache(config_dir).invalidate(environment_definition.get_node_provider())
         if noop:
             print environment_definition.node_provider.noop_actions_string()
         else:
@@ -190,15 +257,30 @@ def launch(env_template=None, env_name=None, config_dir=DEFAULT_ENVIRONMENT, noo
 
         return environment_definition
 
-def _render_table(nodes):
-    table = Texttable()
-    rows = [["ID", "State", "Tags", "Environment", "Address"]]
-    for node in nodes:
-        environment_description = "%s\nDef: %s" % (node.environment_name(), node.environment_definition_name())
-        rows.append([node.id(), node.state(), node.tags(), environment_description, node.address()])
+@cliCall(CONFIG_DIR_OPTION, ENVIRONMENT_TEMPLATE_OPTION, PROPERTY_FILE_OPTION)
+def refill_pool(env_template=None, config_dir=DEFAULT_ENVIRONMENT, property_file=None):
+    """Launches instances into the warm pools of an environment template's node provider, topping each up to its count"""
+    with env_conf_from_dir(config_dir, 'dummy_name', property_file) as env_defs:
+        provider = env_defs[env_template].get_node_provider()
+        if not hasattr(provider, 'refill_pool'):
+            raise StandardError("The node provider for %s does not support warm pools" % env_template)
+
+        for key, launched in sorted(provider.refill_pool().items()):
+            print "Launched %s instances into warm pool %s" % (launched, key)
 
-    table.add_rows(rows)
-    print(table.draw())
+def _render_table(nodes):
+    rows = ([node.id(), node.state(), node.tags(), "%s\nDef: %s" % (node.environment_name(), node.environment_definition_name()), str(node.address())]
+            for node in nodes)
+    # Fits the 80 columns texttable used to shrink the whole table to, while current EC2 instance IDs and IPv4
+    # addresses stay on one line
+    for line in stream_table(["ID", "State", "Tags", "Environment", "Address"], rows, [19, 7, 12, 11, 15]):
+        print(line)
+
+def _print_stream(chunks):
+    for chunk in chunks:
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print
 
 def _conf_file_from_dir(dir, filename):
     if not os.path.exists(dir):
@@ -214,19 +296,19 @@ def _conf_file_from_dir(dir, filename):
 
     return conf_path
 
-def environment_definitions(directory=None, env_name="Ignored", property_file=None, noop=False):
+def environment_definitions(directory=None, env_name="Ignored", property_file=None, noop=False, all_regions=False):
     logger.debug("Using property file %s" % property_file)
     if not env_name:
         raise StandardError("env_name is a required field")
 
     return _definition_from_yaml(directory, "environment_definitions.yaml",
         partial(environment_definitions_from_yaml, service_definitions=service_defs_from_dir(directory),
-            env_name=env_name, noop=noop, all_credentials=_credentials_from_path(directory)), property_file)
+            env_name=env_name, noop=noop, all_credentials=_credentials_from_path(directory), all_regions=all_regions), property_file)
 
 @contextmanager
-def env_conf_from_dir(directory, env_name, property_file, noop=False):
+def env_conf_from_dir(directory, env_name, property_file, noop=False, all_regions=False):
     try:
-        yield environment_definitions(directory, env_name, property_file, noop=noop)
+        yield environment_definitions(directory, env_name, property_file, noop=noop, all_regions=all_regions)
     finally:
         pass
 
@@ -0,0 +1,205 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import threading
+import time
+import yaml
+from phoenix.providers.address import Address
+from phoenix.environment_description import EnvironmentDescription, Location
+from phoenix.plogging import logger
+from phoenix.providers import node_predicates
+
+class InventorySnapshot(object):
+    """
+    The running nodes of one environment, listed from the provider the first time they are asked for and then kept
+    up to date as nodes are started and shut down, so a single command only lists the provider's inventory once.
+    Nodes are tagged in place, so tagging needs no extra bookkeeping.
+    """
+
+    def __init__(self, node_provider, all_credentials, env_name, env_def_name):
+        self.node_provider = node_provider
+        self.all_credentials = all_credentials
+        self.env_name = env_name
+        self.env_def_name = env_def_name
+        self.listed_nodes = None
+        self.lock = threading.Lock()
+
+    def nodes(self):
+        with self.lock:
+            if self.listed_nodes is None:
+                self.listed_nodes = list(self.node_provider.list(self.all_credentials,
+                    node_predicates.running_in_env(self.env_name, self.env_def_name)))
+            return list(self.listed_nodes)
+
+    def node_started(self, node):
+        with self.lock:
+            if self.listed_nodes is not None:
+                self.listed_nodes.append(node)
+
+    def node_shutdown(self, node_id):
+        with self.lock:
+            if self.listed_nodes is not None:
+                self.listed_nodes = [n for n in self.listed_nodes if n.id() != node_id]
+
+    def refresh(self):
+        with self.lock:
+            self.listed_nodes = None
+
+class CachedNode(object):
+    """
+    A running node as it was when it was listed, holding just what listing and describing the node need
+    location: name of the location the node's running environment describes it in, if any
+    """
+
+    def __init__(self, node, location=None):
+        self.node_id = node.id()
+        self.node_state = node.state()
+        # A plain dict, as boto's tags hold on to their connection
+        self.node_tags = dict(node.tags()) if isinstance(node.tags(), dict) else node.tags()
+        self.env_name = node.environment_name()
+        self.env_def_name = node.environment_definition_name()
+        self.node_address = node.address()
+        self.node_attributes = node.attributes() if hasattr(node, 'attributes') else None
+        self.location = location
+
+    def fields(self):
+        """
+        returns: dict of the node's fields, holding only what YAML can write safely
+        """
+        return {'id': self.node_id, 'state': self.node_state, 'tags': self.node_tags, 'env_name': self.env_name,
+                'env_def_name': self.env_def_name, 'dns_name': self.node_address.get_dns_name(),
+                'service_mappings': self.node_address.get_service_mappings(), 'attributes': self.node_attributes,
+                'location': self.location}
+
+    @classmethod
+    def from_fields(cls, fields):
+        cached_node = cls.__new__(cls)
+        cached_node.node_id = fields['id']
+        cached_node.node_state = fields['state']
+        cached_node.node_tags = fields['tags']
+        cached_node.env_name = fields['env_name']
+        cached_node.env_def_name = fields['env_def_name']
+        cached_node.node_address = Address(fields['dns_name'], fields['service_mappings'])
+        cached_node.node_attributes = fields['attributes']
+        cached_node.location = fields['location']
+        return cached_node
+
+    def id(self):
+        return self.node_id
+
+    def state(self):
+        return self.node_state
+
+    def tags(self):
+        return self.node_tags
+
+    def environment_name(self):
+        return self.env_name
+
+    def environment_definition_name(self):
+        return self.env_def_name
+
+    def address(self):
+        return self.node_address
+
+    def attributes(self):
+        return self.node_attributes
+
+class InventoryCache(object):
+    """
+    The running nodes of environments as they were last listed, kept on disk so that read only commands run one after
+    another can answer without listing the provider's inventory again. There is a file per provider, named after the
+    provider's hash, holding an entry per environment which expires ttl seconds after it was listed. Commands which
+    change an environment invalidate its provider's file. The files are YAML, read with safe_load so that nothing in
+    a configuration directory can run code as it is loaded.
+    """
+
+    def __init__(self, directory, ttl=60, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.clock = clock
+
+    def get(self, node_provider, env_template, env_name, scope=None):
+        """
+        scope: anything else the listing depended on, such as whether every region was listed. Only a listing cached
+        with the same scope answers
+        returns: list of CachedNode, or None if the environment hasn't been listed within the ttl
+        """
+        entry = self._entries(node_provider).get((env_template, env_name, scope))
+        if entry is None or self.clock() - entry['listed_at'] > self.ttl:
+            return None
+        return entry['nodes']
+
+    def put(self, node_provider, env_template, env_name, cached_nodes, scope=None):
+        """
+        cached_nodes: list of CachedNode for the running nodes of the environment
+        scope: anything else the listing depended on, as for get
+        """
+        entries = self._entries(node_provider)
+        entries[(env_template, env_name, scope)] = {'listed_at': self.clock(), 'nodes': list(cached_nodes)}
+        self._write(self._path(node_provider), entries)
+
+    def invalidate(self, node_provider):
+        if os.path.exists(self._path(node_provider)):
+            os.remove(self._path(node_provider))
+
+    def _path(self, node_provider):
+        return os.path.join(self.directory, "%x.inventory" % (hash(node_provider) & 0xffffffff))
+
+    def _entries(self, node_provider):
+        path = self._path(node_provider)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as cache_file:
+                return dict(((entry['env_template'], entry['env_name'], entry['scope']),
+                             {'listed_at': entry['listed_at'], 'nodes': [CachedNode.from_fields(fields) for fields in entry['nodes']]})
+                            for entry in yaml.safe_load(cache_file) or [])
+        except Exception as error:
+            logger.warn("Ignoring unreadable inventory cache %s: %s" % (path, error))
+            return {}
+
+    def _write(self, path, entries):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Written alongside and renamed into place, so a command reading the cache never sees half a file
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'w') as cache_file:
+                yaml.safe_dump([{'env_template': env_template, 'env_name': env_name, 'scope': scope, 'listed_at': entry['listed_at'],
+                                 'nodes': [cached_node.fields() for cached_node in entry['nodes']]}
+                                for (env_template, env_name, scope), entry in entries.items()], cache_file)
+        except yaml.YAMLError as error:
+            # A provider whose nodes hold more than plain values just isn't cached
+            os.remove(temporary_path)
+            logger.warn("Unable to save inventory cache %s: %s" % (path, error))
+            return
+        os.rename(temporary_path, path)
+
+def describe_cached_environment(env_name, cached_nodes):
+    """
+    returns: EnvironmentDescription of the cached nodes, in the locations they were listed in
+    """
+    locations = []
+    for cached_node in cached_nodes:
+        if cached_node.location is None:
+            continue
+        matching = [location for location in locations if location.get_name() == cached_node.location]
+        if len(matching):
+            matching[0].get_nodes().append(cached_node)
+        else:
+            locations.append(Location(cached_node.location, [cached_node]))
+    return EnvironmentDescription(env_name, locations)
@@ -0,0 +1,159 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import yaml
+from phoenix.plogging import logger
+
+PROVISIONED = 'provisioned'
+READY = 'ready'
+TAGGED = 'tagged'
+BOOTSTRAPPED = 'bootstrapped'
+BUNDLE_UPLOADED = 'bundle uploaded'
+APPLIED = 'applied'
+
+def launch_journal_path(config_dir, env_template, env_name):
+    return os.path.join(config_dir, '.launch_journals', '%s.%s.journal' % (env_template, env_name))
+
+class LaunchJournal(object):
+    """
+    An append only record of the launch steps completed on each node, so that a launch which fails part way
+    through can be resumed without redoing the work that already succeeded.
+    path: file to keep the journal in. Without one, steps are only remembered for the life of this object
+    resume: whether to carry on from the steps already in the file, rather than starting a new journal
+    """
+
+    def __init__(self, path=None, resume=False):
+        self.path = path
+        self.completed_steps = set()
+        self.provisioned = {}
+        self.checksums = {}
+        self.lock = threading.Lock()
+
+        if not path:
+            return
+
+        if resume and os.path.exists(path):
+            self._load()
+        else:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def record(self, node_id, step, service_name=None, definition=None, services=None, checksum=None):
+        """
+        Notes that a step is complete. Provisioning also records which node definition (by position) the node
+        was started for, and that definition's services.
+        checksum: of what the step used, such as the bundle uploaded, so a resumed launch can tell it has changed
+        """
+        entry = {'node': node_id, 'step': step}
+        if service_name is not None: entry['service'] = service_name
+        if definition is not None: entry['definition'] = definition
+        if services is not None: entry['services'] = list(services)
+        if checksum is not None: entry['checksum'] = checksum
+
+        with self.lock:
+            self._remember(entry)
+            if self.path:
+                # Each entry is a single short line, so appends from several processes don't interleave
+                with open(self.path, 'a') as journal_file:
+                    journal_file.write(yaml.dump(entry, default_flow_style=True, width=1000000))
+
+    def record_all(self, entries):
+        """
+        entries: steps kept back by a DeferredJournal, as the keyword arguments of record
+        """
+        for entry in entries:
+            self.record(**entry)
+
+    def deferred(self):
+        """
+        returns: DeferredJournal knowing the steps recorded so far, for use in a forked process
+        """
+        deferred_journal = DeferredJournal()
+        with self.lock:
+            deferred_journal.completed_steps = set(self.completed_steps)
+            deferred_journal.provisioned = dict(self.provisioned)
+            deferred_journal.checksums = dict(self.checksums)
+        return deferred_journal
+
+    def completed(self, node_id, step, service_name=None, checksum=None):
+        """
+        checksum: if given, the step only counts as complete if it was recorded with the same checksum
+        """
+        if checksum is not None and self.checksums.get((node_id, step, service_name)) != checksum:
+            return False
+        return (node_id, step, service_name) in self.completed_steps
+
+    def provisioned_definition(self, node_id):
+        """
+        returns: tuple of (position of the node definition, services of that definition) the node was started
+        for, or None if the node wasn't provisioned by the journalled launch
+        """
+        return self.provisioned.get(node_id)
+
+    def started_but_not_ready(self, node_id):
+        return self.completed(node_id, PROVISIONED) and not self.completed(node_id, READY)
+
+    def finish(self):
+        # Once a launch has completed there's nothing left to resume
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _remember(self, entry):
+        self.completed_steps.add((entry['node'], entry['step'], entry.get('service')))
+        if 'checksum' in entry:
+            self.checksums[(entry['node'], entry['step'], entry.get('service'))] = entry['checksum']
+        if entry['step'] == PROVISIONED:
+            self.provisioned[entry['node']] = (entry.get('definition'), entry.get('services', []))
+
+    def _load(self):
+        with open(self.path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = yaml.load(line)
+                except yaml.YAMLError:
+                    # The launch may have died half way through writing its last entry
+                    logger.warn("Ignoring unreadable launch journal entry %s" % line.strip())
+                    continue
+                if isinstance(entry, dict) and 'node' in entry and 'step' in entry:
+                    self._remember(entry)
+
+class DeferredJournal(LaunchJournal):
+    """
+    Keeps back the steps recorded in a forked process, for the parent to record in its own journal once the child
+    has finished. The child can't safely take the parent journal's lock, as another thread may hold it as it forks.
+    entries: steps recorded, as the keyword arguments of record
+    """
+
+    def __init__(self):
+        LaunchJournal.__init__(self)
+        self.entries = []
+
+    def record(self, node_id, step, service_name=None, definition=None, services=None, checksum=None):
+        LaunchJournal.record(self, node_id, step, service_name, definition, services, checksum)
+        self.entries.append({'node_id': node_id, 'step': step, 'service_name': service_name, 'definition': definition,
+                             'services': services, 'checksum': checksum})
+
+class NoJournal(object):
+    """
+    Remembers no steps, for configuring services outside of a journalled launch
+    """
+
+    def record(self, node_id, step, service_name=None, definition=None, services=None, checksum=None):
+        pass
+
+    def completed(self, node_id, step, service_name=None, checksum=None):
+        return False
@@ -12,12 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import time
 import re
 import socket
+import threading
+import Queue
+from collections import defaultdict
 from time import sleep
 import boto
 import boto.ec2
+from boto.ec2.regioninfo import RegionInfo
 from boto.exception import EC2ResponseError
 from fabric.context_managers import settings
 from fabric.operations import run, put
@@ -27,8 +32,18 @@ import yaml
 from node_predicates import all_nodes
 from address import Address
 from phoenix.plogging import logger
+from phoenix.utilities.connection_pool import ConnectionPool
+from phoenix.utilities.port_prober import PortProber
+from phoenix.utilities.utility import is_positive_integer
+from phoenix.utilities.worker_pool import call_in_subprocess
 from phoenix.providers.node_predicates import running_nodes
 
+# Tag naming the warm pool an idle instance belongs to
+POOL_TAG = 'phoenix_pool'
+
+# A ready_probe of 'cloud-init' waits for cloud-init to mark the boot as finished
+CLOUD_INIT_FINISHED = 'test -f /var/lib/cloud/instance/boot-finished'
+
 class AWSNodeDefinition():
 
     def __init__(self, ami_id=None, size=None, credentials_name=None, region='us-east-1', services=None, security_groups=None, aws_key_name=None, availability_zone=None):
@@ -82,44 +97,233 @@ class AWSNodeDefinition():
         return "AWSNodeDefinition AMI:'%s' Size:'%s' Credentials:'%s' Region:'%s' Services:'%s'" %\
                (self.ami_id, self.size, self.credentials_name, self.region, self.services)
 
+# The EC2 filter for each node attribute predicates can hold conditions on
+FILTERS_FOR_ATTRIBUTES = {'environment_name': 'tag:env_name', 'environment_definition_name': 'tag:env_def_name',
+                          'state': 'instance-state-name'}
+
+def instance_filters(node_predicate):
+    """
+    Only running instances are ever listed as nodes, so the filters always ask for those
+    returns: EC2 filters picking out the instances which could match the predicate, or None if none could
+    """
+    conditions = dict(node_predicates.conditions_of(node_predicate) or {})
+    conditions['state'] = conditions.get('state', frozenset(['running'])) & frozenset(['running'])
+
+    filters = {}
+    for attribute, values in conditions.items():
+        if not len(values):
+            return None
+        filters[FILTERS_FOR_ATTRIBUTES[attribute]] = sorted(values)
+    return filters
+
+def definition_fingerprint(node_definition):
+    return (node_definition.ami_id, node_definition.size, node_definition.credentials_name, node_definition.region,
+            tuple(sorted(node_definition.services)))
+
+class InstanceStatePoller:
+    """
+    Refreshes the state of every instance being waited on with one DescribeInstances call per region each tick,
+    rather than each waiting node polling its own instance. Ticks start min_interval seconds apart, backing off
+    towards max_interval while nothing changes.
+    connection_for_region: function taking a region name and returning an EC2 connection
+    """
+
+    def __init__(self, connection_for_region, min_interval=2, max_interval=15):
+        self.connection_for_region = connection_for_region
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.polling = False
+
+    def wait_until_running(self, instance_record, timeout):
+        """
+        Blocks until the instance is running with an IP address, or timeout seconds have passed
+        returns: the latest InstanceRecord of the instance, which is only running if it started in time
+        """
+        if _is_running(instance_record):
+            return instance_record
+
+        # The latest record, replaced by each refresh
+        waiter = [instance_record, threading.Event()]
+        with self.lock:
+            self.waiting[instance_record.id] = waiter
+            if not self.polling:
+                self.polling = True
+                poller = threading.Thread(target=self._poll)
+                poller.daemon = True
+                poller.start()
+
+        waiter[1].wait(timeout)
+        with self.lock:
+            self.waiting.pop(instance_record.id, None)
+        return waiter[0]
+
+    def _poll(self):
+        interval = self.min_interval
+        while True:
+            with self.lock:
+                if not self.waiting:
+                    self.polling = False
+                    return
+                waiting = dict(self.waiting)
+
+            changed = False
+            ids_by_region = defaultdict(lambda: [])
+            for instance_record, running in waiting.values():
+                ids_by_region[instance_record.region_name].append(instance_record.id)
+
+            for region_name, instance_ids in ids_by_region.items():
+                try:
+                    changed = self._refresh(region_name, instance_ids, waiting) or changed
+                except Exception as e:
+                    logger.warn("Unable to refresh the state of instances in region %s: %s" % (region_name, e))
+
+            interval = self.min_interval if changed else min(interval * 2, self.max_interval)
+            sleep(interval)
+
+    def _refresh(self, region_name, instance_ids, waiting):
+        changed = False
+        # Filtered rather than asked for by ID, as EC2 fails the whole call for an ID it can't see yet, which is usual
+        # just after an instance is started
+        reservations = self.connection_for_region(region_name).get_all_instances(filters={'instance-id': instance_ids})
+        for refreshed in [instance for reservation in reservations for instance in reservation.instances]:
+            waiter = waiting[refreshed.id]
+            if refreshed.state != waiter[0].state:
+                changed = True
+            waiter[0] = InstanceRecord.from_boto(refreshed)
+            if _is_running(waiter[0]):
+                waiter[1].set()
+        return changed
+
+def _is_running(instance_record):
+    return instance_record.state == 'running' and instance_record.ip_address is not None
+
+class InstanceRecord(object):
+    """
+    The parts of an EC2 instance phoenix uses. A boto Instance carries an attribute dict, its region and a
+    connection, which adds up when thousands of instances are listed, so nodes keep one of these instead and
+    fetch boto's object again only when they need it. Records are never changed - an instance which changes
+    gets a new record.
+    tags: tuple of (name, value) pairs
+    """
+    __slots__ = ('id', 'image_id', 'instance_type', 'region_name', 'placement', 'state', 'public_dns_name', 'ip_address', 'tags')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            object.__setattr__(self, field, fields.get(field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Instance records can't be changed")
+
+    def __getstate__(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field in self.__slots__:
+            object.__setattr__(self, field, state.get(field))
+
+    def __eq__(self, other):
+        return isinstance(other, InstanceRecord) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "InstanceRecord(%s)" % ", ".join(["%s=%r" % (field, getattr(self, field)) for field in self.__slots__])
+
+    def replace(self, **fields):
+        state = self.__getstate__()
+        state.update(fields)
+        return InstanceRecord(**state)
+
+    def tag(self, name, default=None):
+        for tag_name, value in self.tags:
+            if tag_name == name:
+                return value
+        return default
+
+    def tag_dict(self):
+        return dict(self.tags)
+
+    @classmethod
+    def from_boto(cls, boto_instance):
+        # Instances put together by hand may have no region
+        return cls(id=boto_instance.id, image_id=boto_instance.image_id, instance_type=boto_instance.instance_type,
+                   region_name=getattr(boto_instance.region, 'name', None), placement=boto_instance.placement,
+                   state=boto_instance.state, public_dns_name=boto_instance.public_dns_name,
+                   ip_address=boto_instance.ip_address, tags=tuple(sorted(dict(boto_instance.tags or {}).items())))
+
 class AWSRunningNode():
-    def __init__(self, boto_instance, aws_security, connection_provider=None):
-        self.boto_instance = boto_instance
-        self.environment = self.boto_instance.tags['env_name']
-        self.services = self.boto_instance.tags['services']
+    def __init__(self, boto_instance, aws_security, connection_provider=None, state_poller=None, port_prober=None, ready_probe=None,
+                 connection_for_region=None):
+        # boto_instance: the boto Instance, or an InstanceRecord of it. Only the record is kept
+        self.record = boto_instance if isinstance(boto_instance, InstanceRecord) else InstanceRecord.from_boto(boto_instance)
+        self.environment = self.record.tag('env_name')
+        self.services = self.record.tag('services')
         self.aws_security = aws_security
+        self.unsaved_services = False
+        # The services tag last decoded, and what it decoded to
+        self.decoded_services_tag = None
+        self.decoded_services = None
         self.connection_provider = connection_provider
         if self.connection_provider is None :
             self.connection_provider = EC2ConnectionProvider()
+        # Function taking a region name and returning an EC2 connection, for fetching the boto instance again
+        self.connection_for_region = connection_for_region
+        # Without a poller and prober shared with other nodes, the node refreshes its own instance and tries SSH itself
+        self.state_poller = state_poller
+        self.port_prober = port_prober
+        # Command which succeeds on the node once it has finished booting
+        self.ready_probe = ready_probe
 
     def __str__(self):
         return "AWS Running node. id:%s ami_id:%s size:%s credentials:%s region:%s services:%s" % \
-               (self.boto_instance.id, self.boto_instance.image_id, self.boto_instance.instance_type, self._tag('credentials_name'), self.boto_instance.region, self.services)
+               (self.record.id, self.record.image_id, self.record.instance_type, self._tag('credentials_name'), self.record.region_name, self.services)
 
     def __repr__(self):
         return "AWS Running node. id:%s ami_id:%s size:%s credentials:%s region:%s services:%s" % \
-               (self.boto_instance.id, self.boto_instance.image_id, self.boto_instance.instance_type, self._tag('credentials_name'), self.boto_instance.region, self.services)
+               (self.record.id, self.record.image_id, self.record.instance_type, self._tag('credentials_name'), self.record.region_name, self.services)
 
     def id(self):
-        return self.boto_instance.id
+        return self.record.id
 
     def ami_id(self):
-        return self.boto_instance.image_id
+        return self.record.image_id
 
     def state(self):
-        return self.boto_instance.state
+        return self.record.state
 
     def tags(self):
-        return self.boto_instance.tags
+        return self.record.tag_dict()
 
     def region(self):
-        return self.boto_instance.region
+        # Just the region's name - a connection to it comes from the provider
+        return RegionInfo(name=self.record.region_name)
+
+    def region_name(self):
+        return self.record.region_name
 
     def placement(self):
-        return self.boto_instance.placement
+        return self.record.placement
+
+    def boto_instance(self):
+        """
+        Fetches boto's Instance for the node, for changes which need more than the instance's ID
+        """
+        if self.connection_for_region is None:
+            raise StandardError("Unable to fetch instance %s without a connection to its region" % self.id())
+        reservations = self.connection_for_region(self.region_name()).get_all_instances(filters={'instance-id': [self.id()]})
+        instances = [instance for reservation in reservations for instance in reservation.instances]
+        if not len(instances):
+            raise StandardError("No node with ID %s found" % self.id())
+        return instances[0]
+
+    def refresh(self):
+        self.record = InstanceRecord.from_boto(self.boto_instance())
 
     def _dns_name(self):
-        return self.boto_instance.public_dns_name
+        return self.record.public_dns_name
 
     def _admin_user(self):
         return self._tag('admin_user')
@@ -143,7 +347,11 @@ class AWSRunningNode():
         service_to_ports_dict = self.get_services()
         ports = reduce(lambda x,y: x + y.ports, connectivities, [])
         service_to_ports_dict[service_name] = ports
-        self.boto_instance.add_tag('services', yaml.dump(service_to_ports_dict))
+        # Only changed here - the provider writes the tag when it flushes tags, once all the node's services are known
+        tags = self.record.tag_dict()
+        tags['services'] = yaml.dump(service_to_ports_dict)
+        self.record = self.record.replace(tags=tuple(sorted(tags.items())))
+        self.unsaved_services = True
         for connectivity in connectivities:
             self.aws_security.open_ports(service_name, connectivity)
 
@@ -151,8 +359,12 @@ class AWSRunningNode():
         return {'id':self.id(),'ami_id':self.ami_id(),'dns_name':self._dns_name(),'services':self.address().get_service_mappings(), 'availability_zone':self.placement()}
 
     def get_services(self):
-        service_tag_content = self.tags().get('services')
-        return yaml.load(service_tag_content)
+        service_tag_content = self.record.tag('services')
+        if self.decoded_services is None or service_tag_content != self.decoded_services_tag:
+            self.decoded_services = yaml.load(service_tag_content)
+            self.decoded_services_tag = service_tag_content
+        # A copy, so callers can change it without changing the decoded tag
+        return dict(self.decoded_services) if self.decoded_services is not None else None
 
     def _running_node(self):
         if not self.state() == 'running':
@@ -180,12 +392,20 @@ class AWSRunningNode():
         start = time.time()
         node_is_up = False
         while time.time() - start <= start_up_timeout :
-            self.boto_instance.update()
-            if self.state() == 'running' and self.boto_instance.ip_address is not None:
-                node_is_up = self.connection_provider.connected_to_node(self.boto_instance.ip_address, 22)
+            if self.state_poller:
+                self.record = self.state_poller.wait_until_running(self.record, max(0, start_up_timeout - (time.time() - start)))
+            elif not _is_running(self.record):
+                self.refresh()
+            if _is_running(self.record):
+                if self.port_prober:
+                    node_is_up = self.port_prober.wait_until_open(self.record.ip_address, 22,
+                        max(0, start_up_timeout - (time.time() - start)))
+                else:
+                    node_is_up = self.connection_provider.connected_to_node(self.record.ip_address, 22)
                 if node_is_up :
                     logger.info("*********Node %s is ready!********" % self.id())
                     break
+                sleep(1)
             else:
                 logger.debug("Waiting for 5 seconds for node %s" % self.id())
                 sleep(5)
@@ -193,18 +413,31 @@ class AWSRunningNode():
         if not node_is_up :
             raise Exception("Node %s is not running" % self.id())
 
-        # For some reason, with the Ubuntu instances we use, if we try and install packages too quickly after the machine
-        # boots, we don't get the transient dependencies - highly annoying.
-        sleep(10)
+        if self.ready_probe:
+            self._wait_for_ready_probe(max(1, int(start_up_timeout - (time.time() - start))))
+        else:
+            # For some reason, with the Ubuntu instances we use, if we try and install packages too quickly after the machine
+            # boots, we don't get the transient dependencies - highly annoying.
+            sleep(10)
         callback()
 
+    def _wait_for_ready_probe(self, timeout):
+        # The probe is retried on the node, so one SSH session returns as soon as it passes. Fabric's env is shared
+        # by the whole process, so the session runs in its own process like the other remote commands
+        command = "for attempt in $(seq %s); do (%s) && exit 0; sleep 1; done; exit 1" % (timeout, self.ready_probe)
+        try:
+            call_in_subprocess(lambda: self.run_command(command))
+        except StandardError as e:
+            raise Exception("Node %s did not pass its ready probe within %s seconds: %s" % (self.id(), timeout, e))
+
     def matches_definition(self, node_definition):
         logger.info("Matching %s against definition %s" % (self, node_definition))
-        return self.boto_instance.image_id == node_definition.ami_id and \
-        self.boto_instance.instance_type == node_definition.size and \
-        self._tag('credentials_name') == node_definition.credentials_name and \
-        self.boto_instance.region.name == node_definition.region and \
-        self.get_services().keys() == node_definition.services
+        return self.fingerprint() == definition_fingerprint(node_definition)
+
+    def fingerprint(self):
+        # Must agree with definition_fingerprint for the definition the node was started from
+        return (self.record.image_id, self.record.instance_type, self._tag('credentials_name'),
+                self.record.region_name, tuple(sorted(self.get_services().keys())))
 
     def environment_definition_name(self):
         return self._tag('env_def_name')
@@ -213,21 +446,37 @@ class AWSRunningNode():
         return self._tag('env_name')
 
     def _tag(self, tagname, default="Unknown"):
-        if self.boto_instance.tags.has_key(tagname):
-            return self.boto_instance.tags[tagname]
+        tags = self.record.tag_dict()
+        if tagname in tags:
+            return tags[tagname]
 
         logger.warn("Unable to retrieve tag %s for instance %s, returning %s instead" % (tagname, self.id(), default))
         return default
 
 class AWSNodeProvider:
 
-    def __init__(self, public_api_key=None, private_api_key=None, connection_provider = None, start_up_timeout = 90, **kwargs):
+    def __init__(self, public_api_key=None, private_api_key=None, connection_provider = None, start_up_timeout = 90, concurrency_limit = 1, ready_probe = None,
+                 image_cache_ttl = 3600, image_cache_file = None, warm_pool = None, **kwargs):
         self.public_api_key = public_api_key
         self.private_api_key = private_api_key
         self.connection_provider = connection_provider
         if self.connection_provider is None:
             self.connection_provider = EC2ConnectionProvider()
         self.start_up_timeout = start_up_timeout
+        self.concurrency_limit = concurrency_limit
+        self.ready_probe = CLOUD_INIT_FINISHED if ready_probe == 'cloud-init' else ready_probe
+        # Regions to look for nodes in. None means every region
+        self.regions = None
+        self.security_group_catalogs = {}
+        self.security_group_catalogs_lock = threading.Lock()
+        self.state_poller = InstanceStatePoller(self._connection_for_region)
+        self.port_prober = PortProber()
+        self.image_catalog = ImageCatalog(self._connection_for_region, image_cache_ttl,
+            os.path.expanduser(image_cache_file) if image_cache_file else None)
+        self.warm_pool = WarmPool(self._connection_for_region, warm_pool)
+
+    def _connection_for_region(self, region_name):
+        return self.connection_provider.ec2_connection_for_region(region_name, self.public_api_key, self.private_api_key)
 
     def __eq__(self, other):
         return self.private_api_key == other.private_api_key and self.public_api_key == other.public_api_key
@@ -238,22 +487,44 @@ class AWSNodeProvider:
     def __str__(self):
         return "AWS Node Provider using public key %s" % self.public_api_key
 
+    def limit_to_regions_of(self, node_definitions):
+        # Only the regions an environment's nodes are defined in need listing
+        regions = sorted(set(node_definition.region for node_definition in node_definitions))
+        self.regions = regions if regions else None
+
     def list(self, all_credentials, node_predicate = all_nodes):
-        nodes = []
+        return list(self.iter_nodes(all_credentials, node_predicate))
 
-        for boto_instance in [i for i in self.connection_provider.get_all_boto_instances(self.public_api_key, self.private_api_key) if i.state == 'running']:
+    def iter_nodes(self, all_credentials, node_predicate = all_nodes):
+        """
+        Yields the running nodes which pass node_predicate as EC2 returns them, a page at a time, so the first nodes
+        can be used before the rest of the account has been listed
+        """
+        filters = instance_filters(node_predicate)
+        if filters is None:
+            return
+
+        # The nodes of an environment share its security group in each region
+        aws_securities = {}
+        for boto_instance in self.connection_provider.get_all_boto_instances(self.public_api_key, self.private_api_key, self.regions, filters):
+            if boto_instance.state != 'running':
+                continue
             if boto_instance.tags.has_key('env_def_name'):
-                aws_security = AWSSecurity(self.connection_provider.ec2_connection_for_region(boto_instance.region.name, self.public_api_key, self.private_api_key),
-                    self._security_group_name(boto_instance.tags['env_def_name'], boto_instance.tags['env_name']))
+                security_group = (boto_instance.region.name, self._security_group_name(boto_instance.tags['env_def_name'], boto_instance.tags['env_name']))
+                if not security_group in aws_securities:
+                    aws_securities[security_group] = self._aws_security(*security_group)
+                aws_security = aws_securities[security_group]
 
-                aws_node = AWSRunningNode(boto_instance, aws_security)
+                aws_node = AWSRunningNode(boto_instance, aws_security, state_poller=self.state_poller, port_prober=self.port_prober,
+                    ready_probe=self.ready_probe, connection_for_region=self._connection_for_region)
                 if node_predicate(aws_node):
-                    nodes.append(aws_node)
-            else:
+                    yield aws_node
+            elif not boto_instance.tags.has_key(POOL_TAG):
                 logger.warn(
                     "Unable to find env_def_name for %s:%s, will not be included in listing in state %s" % (boto_instance.id, boto_instance.region, boto_instance.state))
 
-        return nodes
+    def location_of(self, aws_running_node):
+        return aws_running_node.region_name()
 
     def get_locations(self, region_nodes_map):
         locations = []
@@ -261,20 +532,22 @@ class AWSNodeProvider:
             locations.append(phoenix.environment_description.Location(region, nodes))
         return locations
 
-    def get_running_environment(self, env_name, env_template_name, all_credentials):
-        nodes = self.list(all_credentials, lambda x: node_predicates.running_in_env(env_name, env_template_name)(x))
+    def get_running_environment(self, env_name, env_template_name, all_credentials, nodes=None):
+        # nodes: the running nodes of the environment, if they have already been listed
+        if nodes is None:
+            nodes = self.list(all_credentials, node_predicates.running_in_env(env_name, env_template_name))
         region_nodes_map = {}
         for node in nodes:
-            if not node.region().name in region_nodes_map.keys():
-                region_nodes_map.update({node.region().name:[node]})
+            if not self.location_of(node) in region_nodes_map.keys():
+                region_nodes_map.update({self.location_of(node):[node]})
             else:
-                region_nodes_map[node.region().name].append(node)
+                region_nodes_map[self.location_of(node)].append(node)
 
         locations = self.get_locations(region_nodes_map)
         return phoenix.environment_description.EnvironmentDescription(env_name, locations)
 
     def _find_node(self, identity):
-        nodes = [i for i in self.connection_provider.get_all_boto_instances(self.public_api_key, self.private_api_key) if i.id == identity.decode('utf-8')]
+        nodes = [i for i in self.connection_provider.get_all_boto_instances(self.public_api_key, self.private_api_key, self.regions) if i.id == identity.decode('utf-8')]
         if not len(nodes):
             raise StandardError("No node with ID %s found" % identity)
 
@@ -283,35 +556,115 @@ class AWSNodeProvider:
     def shutdown(self, identity):
         self._find_node(identity).terminate()
 
+    def shutdown_nodes(self, aws_running_nodes):
+        # The nodes already know their regions, so each region's instances are terminated in one call by ID
+        ids_by_region = defaultdict(lambda: [])
+        for node in aws_running_nodes:
+            ids_by_region[node.region_name()].append(node.id())
+
+        for region_name, instance_ids in ids_by_region.items():
+            logger.info("Terminating instances %s in region %s" % (", ".join(instance_ids), region_name))
+            conn = self.connection_provider.ec2_connection_for_region(region_name, self.public_api_key, self.private_api_key)
+            conn.terminate_instances(instance_ids=instance_ids)
+
+    def check_node_definitions(self, aws_node_definitions):
+        # Every AMI about to be launched is checked up front, so a bad id fails the launch before any instance starts
+        ami_ids_by_region = defaultdict(lambda: [])
+        for aws_node_definition in aws_node_definitions:
+            ami_ids_by_region[aws_node_definition.region].append(aws_node_definition.ami_id)
+
+        errors = []
+        for region_name, ami_ids in sorted(ami_ids_by_region.items()):
+            try:
+                self.image_catalog.describe(region_name, ami_ids)
+            except StandardError as error:
+                errors.append(str(error))
+        if len(errors):
+            raise StandardError("Unable to launch nodes,\n" + ",\n".join(errors))
+
     def start(self, aws_node_definition, env_name, env_def_name):
+        return self.start_batch([aws_node_definition], env_name, env_def_name)[0]
+
+    def launch_batch_key(self, aws_node_definition):
+        # Definitions with the same key are launched as one reservation
+        return (aws_node_definition.ami_id, aws_node_definition.size, aws_node_definition.aws_key_name, aws_node_definition.region,
+                aws_node_definition.availability_zone, tuple(sorted(aws_node_definition.services)),
+                tuple(sorted(aws_node_definition.security_groups or [])), aws_node_definition.credentials_name)
+
+    def start_batch(self, aws_node_definitions, env_name, env_def_name):
+        """
+        Starts a node for each of a list of definitions which share a launch_batch_key, with a single reservation
+        returns: the nodes, in the same order as the definitions
+        """
+        aws_node_definition = aws_node_definitions[0]
+        count = len(aws_node_definitions)
         tags = { 'env_name' : env_name,
                  'env_def_name' : env_def_name,
-                 'services' : {},
+                 'services' : yaml.dump({}),
                  'credentials_name': aws_node_definition.credentials_name,
                  'admin_user' : aws_node_definition.admin_user,
                  'path_to_private_key' : aws_node_definition.path_to_private_key}
 
         conn = self.connection_provider.ec2_connection_for_region(aws_node_definition.region, self.public_api_key, self.private_api_key)
-        ami = conn.get_image(aws_node_definition.ami_id)
+        self.image_catalog.describe(aws_node_definition.region, [aws_node_definition.ami_id])
 
-        aws_security = AWSSecurity(conn, env_def_name + '/' + env_name)
+        aws_security = self._aws_security(aws_node_definition.region, self._security_group_name(env_def_name, env_name))
 
         security_groups = [aws_security.create_security_group_if_it_does_not_exists(x) for x in aws_node_definition.services]
 
         security_groups = security_groups + aws_node_definition.security_groups if aws_node_definition.security_groups else security_groups
 
-        reservation = ami.run(instance_type=aws_node_definition.size, key_name=aws_node_definition.aws_key_name,
-            security_groups=security_groups, placement=aws_node_definition.availability_zone)
+        boto_instances = []
+        if self.warm_pool.has_pool_for(aws_node_definition):
+            boto_instances = self.warm_pool.claim(aws_node_definition, count, tags, aws_security.security_group_ids(security_groups))
+
+        if len(boto_instances) < count:
+            to_launch = count - len(boto_instances)
+            reservation = conn.run_instances(aws_node_definition.ami_id, min_count=to_launch, max_count=to_launch, instance_type=aws_node_definition.size,
+                key_name=aws_node_definition.aws_key_name, security_groups=security_groups, placement=aws_node_definition.availability_zone)
+
+            # Every instance in the reservation gets the same tags, so they can all be written in one call
+            conn.create_tags([boto_instance.id for boto_instance in reservation.instances], tags)
+            for boto_instance in reservation.instances:
+                boto_instance.tags.update(tags)
+            boto_instances = boto_instances + reservation.instances
+
+        running_nodes = []
+        for boto_instance in boto_instances:
+            running_nodes.append(AWSRunningNode(boto_instance, aws_security, state_poller=self.state_poller, port_prober=self.port_prober,
+                ready_probe=self.ready_probe, connection_for_region=self._connection_for_region))
 
-        boto_instance = reservation.instances[0]
-        for name, value in tags.items():
-            boto_instance.add_tag(name, value)
+        return running_nodes
 
-        return AWSRunningNode(boto_instance, aws_security)
+    def refill_pool(self):
+        return self.warm_pool.refill()
+
+    def flush_tags(self, aws_running_nodes):
+        """
+        Writes the services tags of nodes which have had services added, with one call for all the nodes in a region
+        whose tag has the same value
+        """
+        unsaved = defaultdict(lambda: [])
+        for node in aws_running_nodes:
+            if node.unsaved_services:
+                unsaved[(node.region_name(), node.tags()['services'])].append(node)
+
+        for (region_name, services), nodes in unsaved.items():
+            conn = self.connection_provider.ec2_connection_for_region(region_name, self.public_api_key, self.private_api_key)
+            conn.create_tags([node.id() for node in nodes], {'services': services})
+            for node in nodes:
+                node.unsaved_services = False
 
     def _security_group_name(self, env_def_name, env_name):
         return env_def_name + '/' + env_name
 
+    def _aws_security(self, region_name, security_group_name):
+        connection = self.connection_provider.ec2_connection_for_region(region_name, self.public_api_key, self.private_api_key)
+        with self.security_group_catalogs_lock:
+            if not region_name in self.security_group_catalogs:
+                self.security_group_catalogs[region_name] = SecurityGroupCatalog(connection)
+        return AWSSecurity(connection, security_group_name, self.security_group_catalogs[region_name])
+
     def validate(self, env_name, env_values, error_list, all_credentials):
         if not 'public_api_key' in env_values:
             error_list.append("Key 'public_api_key' not found for AWS in '%s' environment" % env_name)
@@ -321,6 +674,18 @@ class AWSNodeProvider:
             error_list.append("Key 'private_api_key' not found for AWS in '%s' environment" % env_name)
         elif env_values['private_api_key'] is None or str(env_values['private_api_key']).strip() == "":
             error_list.append("Key 'private_api_key' not defined for AWS in '%s' environment" % env_name)
+        if 'concurrency_limit' in env_values and not is_positive_integer(env_values['concurrency_limit']):
+            error_list.append("Key 'concurrency_limit' must be a positive integer for AWS in '%s' environment" % env_name)
+        if 'ready_probe' in env_values and (not isinstance(env_values['ready_probe'], basestring) or env_values['ready_probe'].strip() == ""):
+            error_list.append("Key 'ready_probe' must be a command for AWS in '%s' environment" % env_name)
+        if 'image_cache_ttl' in env_values and not is_positive_integer(env_values['image_cache_ttl']):
+            error_list.append("Key 'image_cache_ttl' must be a positive integer for AWS in '%s' environment" % env_name)
+        for pool_number, pool_definition in enumerate(env_values.get('warm_pool') or []):
+            for key in ['ami_id', 'size', 'region', 'aws_key_name']:
+                if not pool_definition.get(key):
+                    error_list.append("Key '%s' not set for warm pool number %s for AWS in '%s' environment" % (key, pool_number + 1, env_name))
+            if not is_positive_integer(pool_definition.get('count')):
+                error_list.append("Key 'count' must be a positive integer for warm pool number %s for AWS in '%s' environment" % (pool_number + 1, env_name))
 
     def get_env_definition_translator(self):
         return phoenix.environment_description.AWSEnvironmentDefinitionTranslator()
@@ -328,10 +693,212 @@ class AWSNodeProvider:
     def get_node_startup_timeout(self):
         return self.start_up_timeout
 
+    def get_concurrency_limit(self):
+        return self.concurrency_limit
+
+    def definition_fingerprint(self, node_definition):
+        return definition_fingerprint(node_definition)
+
+class SecurityGroupCatalog:
+    """
+    The security groups of one region, listed the first time one is asked for and kept up to date as groups are
+    created, rather than listing every group for each lookup.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.groups = None
+        self.lock = threading.RLock()
+
+    def get(self, security_group_name):
+        with self.lock:
+            return self._groups().get(security_group_name)
+
+    def create_if_missing(self, security_group_name, description):
+        """
+        returns: True if the group was created, False if it already existed
+        """
+        with self.lock:
+            if security_group_name in self._groups():
+                return False
+
+            try:
+                self.groups[security_group_name] = self.connection.create_security_group(security_group_name, description)
+            except EC2ResponseError as error:
+                # Another phoenix may have created it since the groups were listed
+                if error.error_code != 'InvalidGroup.Duplicate':
+                    raise
+                self.groups = None
+            return True
+
+    def _groups(self):
+        if self.groups is None:
+            self.groups = dict((group.name, group) for group in self.connection.get_all_security_groups())
+        return self.groups
+
+class ImageCatalog:
+    """
+    The AMIs known to exist in each region, so an AMI is described at most once every ttl seconds rather than on
+    every launch. The AMIs still to be described in a region are described together in one call.
+    connection_for_region: function taking a region name and returning an EC2 connection
+    path: file to keep the catalog in between runs. Without one, AMIs are only remembered for the life of the catalog
+    """
+
+    def __init__(self, connection_for_region, ttl=3600, path=None, clock=time.time):
+        self.connection_for_region = connection_for_region
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock
+        # region name -> AMI id -> {'name', 'state', 'described_at'}
+        self.regions = {}
+        self.lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def describe(self, region_name, ami_ids):
+        """
+        Raises a StandardError naming any of the AMIs which don't exist in the region
+        returns: map of AMI id -> the AMI's name and state
+        """
+        now = self.clock()
+        with self.lock:
+            images = self.regions.setdefault(region_name, {})
+            to_describe = sorted(set(ami_id for ami_id in ami_ids
+                                     if not ami_id in images or now - images[ami_id]['described_at'] > self.ttl))
+
+        if len(to_describe):
+            logger.debug("Describing AMIs %s in region %s" % (", ".join(to_describe), region_name))
+            try:
+                described = self.connection_for_region(region_name).get_all_images(image_ids=to_describe)
+            except EC2ResponseError as error:
+                # EC2 refuses the whole call if any of the ids don't exist
+                raise StandardError("Unable to find AMIs %s in region %s: %s" %
+                                    (", ".join(to_describe), region_name, error.error_message or error.error_code))
+
+            found = dict((image.id, {'name': image.name, 'state': image.state, 'described_at': now}) for image in described)
+            missing = [ami_id for ami_id in to_describe if not ami_id in found]
+            if len(missing):
+                raise StandardError("AMIs %s not found in region %s" % (", ".join(missing), region_name))
+
+            with self.lock:
+                images.update(found)
+                self._save()
+
+        return dict((ami_id, images[ami_id]) for ami_id in ami_ids)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as catalog_file:
+                self.regions = yaml.load(catalog_file) or {}
+        except (IOError, yaml.YAMLError) as error:
+            logger.warn("Ignoring unreadable AMI cache %s: %s" % (self.path, error))
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(self.path))):
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)))
+            with open(self.path, 'w') as catalog_file:
+                yaml.dump(self.regions, catalog_file)
+        except (IOError, OSError) as error:
+            logger.warn("Unable to save AMI cache %s: %s" % (self.path, error))
+
+def pool_key(ami_id, size, region_name):
+    return "%s/%s/%s" % (ami_id, size, region_name)
+
+class WarmPool:
+    """
+    Instances already booted from an AMI, which a launch claims rather than booting new ones. Members are tagged with
+    their pool's (AMI, size, region) key and are either running, or stopped to save cost until they are claimed.
+    Claiming a member changes its security groups, which EC2 only allows for instances in a VPC, so pools should be
+    launched into one (the default VPC will do).
+    connection_for_region: function taking a region name and returning an EC2 connection
+    pool_definitions: list of maps of ami_id, size, region, aws_key_name, count and optionally availability_zone
+    """
+
+    def __init__(self, connection_for_region, pool_definitions=None):
+        self.connection_for_region = connection_for_region
+        self.pool_definitions = pool_definitions or []
+        self.lock = threading.Lock()
+
+    def has_pool_for(self, aws_node_definition):
+        return any(pool_key(pool['ami_id'], pool['size'], pool['region']) ==
+                   pool_key(aws_node_definition.ami_id, aws_node_definition.size, aws_node_definition.region)
+                   for pool in self.pool_definitions)
+
+    def claim(self, aws_node_definition, count, tags, security_group_ids):
+        """
+        Hands up to count members which match the definition over to an environment, retagging them, moving them into
+        the definition's security groups and starting any which are stopped
+        returns: the boto instances claimed
+        """
+        region_name = aws_node_definition.region
+        key = pool_key(aws_node_definition.ami_id, aws_node_definition.size, region_name)
+        conn = self.connection_for_region(region_name)
+
+        # Only guards against claiming a member twice in this process - two phoenixes launching at once could both
+        # claim the same member
+        with self.lock:
+            claimed = [boto_instance for boto_instance in self._members(conn, key)
+                       if boto_instance.state in ('running', 'stopped') and boto_instance.key_name == aws_node_definition.aws_key_name and
+                          (not aws_node_definition.availability_zone or boto_instance.placement == aws_node_definition.availability_zone)][:count]
+            if not len(claimed):
+                return []
+
+            instance_ids = [boto_instance.id for boto_instance in claimed]
+            logger.info("Claiming instances %s from warm pool %s" % (", ".join(instance_ids), key))
+            # The environment's tags go on before the pool's comes off, so a claim cut short never loses an instance
+            conn.create_tags(instance_ids, tags)
+            conn.delete_tags(instance_ids, [POOL_TAG])
+
+        for boto_instance in claimed:
+            boto_instance.tags.update(tags)
+            boto_instance.tags.pop(POOL_TAG, None)
+            conn.modify_instance_attribute(boto_instance.id, 'groupSet', security_group_ids)
+
+        stopped_ids = [boto_instance.id for boto_instance in claimed if boto_instance.state == 'stopped']
+        if len(stopped_ids):
+            conn.start_instances(instance_ids=stopped_ids)
+
+        return claimed
+
+    def refill(self):
+        """
+        Launches instances into each pool which has fewer members than its count
+        returns: map of pool key -> number of instances launched into it
+        """
+        launched = {}
+        for pool in self.pool_definitions:
+            key = pool_key(pool['ami_id'], pool['size'], pool['region'])
+            conn = self.connection_for_region(pool['region'])
+            to_launch = pool['count'] - len(self._members(conn, key))
+            launched[key] = max(0, to_launch)
+            if to_launch <= 0:
+                continue
+
+            logger.info("Launching %s instances into warm pool %s" % (to_launch, key))
+            reservation = conn.run_instances(pool['ami_id'], min_count=to_launch, max_count=to_launch, instance_type=pool['size'],
+                key_name=pool['aws_key_name'], placement=pool.get('availability_zone'))
+            conn.create_tags([boto_instance.id for boto_instance in reservation.instances], {POOL_TAG: key})
+
+        return launched
+
+    def _members(self, conn, key):
+        reservations = conn.get_all_instances(filters={'tag:%s' % POOL_TAG: key,
+                                                       'instance-state-name': ['pending', 'running', 'stopping', 'stopped']})
+        # An instance with an environment's tags has been claimed, even if its pool tag is still there
+        return [boto_instance for reservation in reservations for boto_instance in reservation.instances
+                if not 'env_name' in boto_instance.tags]
+
 class AWSSecurity:
-    def __init__(self, connection, env_name):
+    def __init__(self, connection, env_name, catalog=None):
         self.connection = connection
         self.env_name = env_name
+        self.catalog = catalog
+        if self.catalog is None:
+            self.catalog = SecurityGroupCatalog(connection)
 
     def create_security_group_if_it_does_not_exists(self, service_name):
         """
@@ -340,10 +907,8 @@ class AWSSecurity:
         """
         security_group_name = self._get_sec_group_name(service_name)
 
-        sec_groups = self.connection.get_all_security_groups()
-        if not len([x for x in sec_groups if x.name == security_group_name]):
-            logger.info("Creating new Security Group %s" % security_group_name)
-            self.connection.create_security_group(security_group_name, "dynamically created security group")
+        if self.catalog.create_if_missing(security_group_name, "dynamically created security group"):
+            logger.info("Created new Security Group %s" % security_group_name)
         else:
             logger.info("Security Group %s already exists" % security_group_name)
 
@@ -358,20 +923,23 @@ class AWSSecurity:
             - allowed: a list of services that have access to this service Note: WORLD is a special case that allows everybody to access the port
             - protocol: one of 'tcp', 'udp' or 'icmp'
 
-        Method assumes that the security groups will all exist before it is called
+        Method assumes that the security groups will all exist before it is called. Only rules the group doesn't
+        already have are authorized, with every IP range for a port range authorized in one call.
         """
         security_group_name = self._get_sec_group_name(service_name)
         cur_group = self._get_security_group(security_group_name)
-        sources = []
+        cidr_sources = []
+        group_sources = []
 
         for allowed in connectivity.allowed:
             if allowed == 'WORLD':
-                sources.append('0.0.0.0/0')
+                cidr_sources.append('0.0.0.0/0')
             elif re.search("^(\d{1,3}\.){3}\d{1,3}(/\d{1,3})?$", allowed): # allow direct ip access if you'd like
-                sources.append(allowed)
+                cidr_sources.append(allowed)
             else:
-                source_sec_group = self._get_security_group(self._get_sec_group_name(allowed))
-                sources.append(source_sec_group)
+                group_sources.append(self._get_security_group(self._get_sec_group_name(allowed)))
+
+        existing_rules = self._existing_rules(cur_group)
         for port in connectivity.ports:
             if isinstance(port, basestring):
                 from_port = port.split('-')[0] if '-' in port else port
@@ -379,39 +947,158 @@ class AWSSecurity:
             else:
                 from_port = port
                 to_port = port
-            for source in sources:
-                try:
-                    cur_group.authorize(connectivity.protocol, from_port, to_port, source) if isinstance(source, basestring)\
-                        else cur_group.authorize(connectivity.protocol, from_port, to_port, src_group=source)
-                except EC2ResponseError as (error): #TODO: don't re-authorize existing rules
-                    logger.warn("An error has occurred during authorization %s\nThis may be expected if the rule has already been authorized" % error   )
+            port_range = (connectivity.protocol, str(from_port), str(to_port))
+
+            missing_cidrs = [cidr for cidr in cidr_sources if not port_range + (cidr,) in existing_rules]
+            if missing_cidrs:
+                self._authorize(cur_group, connectivity.protocol, from_port, to_port, cidr_ip=missing_cidrs)
+
+            for source_group in group_sources:
+                if not port_range + (('group', source_group.id),) in existing_rules and \
+                   not port_range + (('group_name', source_group.name),) in existing_rules:
+                    self._authorize(cur_group, connectivity.protocol, from_port, to_port, src_group=source_group)
+
+    def _existing_rules(self, security_group):
+        # Each rule is keyed by protocol, port range and source - an IP range, or the id and name of a group
+        rules = set()
+        for rule in security_group.rules:
+            port_range = (rule.ip_protocol, str(rule.from_port), str(rule.to_port))
+            for grant in rule.grants:
+                if grant.cidr_ip:
+                    rules.add(port_range + (grant.cidr_ip,))
+                if grant.group_id:
+                    rules.add(port_range + (('group', grant.group_id),))
+                if grant.name:
+                    rules.add(port_range + (('group_name', grant.name),))
+        return rules
+
+    def _authorize(self, security_group, protocol, from_port, to_port, cidr_ip=None, src_group=None):
+        try:
+            security_group.authorize(protocol, from_port, to_port, cidr_ip=cidr_ip, src_group=src_group)
+        except EC2ResponseError as (error):
+            # Someone else may have authorized the rule since the group was listed
+            logger.warn("An error has occurred during authorization %s\nThis may be expected if the rule has already been authorized" % error)
+
+    def security_group_ids(self, security_group_names):
+        return [self._get_security_group(security_group_name).id for security_group_name in security_group_names]
 
     def _get_sec_group_name(self, service_name):
         return self.env_name + '/' + service_name
 
     def _get_security_group(self, security_group_name):
-        sec_groups = self.connection.get_all_security_groups()
-        cur_group = [x for x in sec_groups if x.name == security_group_name].pop()
+        cur_group = self.catalog.get(security_group_name)
+        if cur_group is None:
+            raise StandardError("Security group %s does not exist" % security_group_name)
         return cur_group
 
 
+# Shared by every EC2ConnectionProvider, so nodes, security groups and commands run in the same process all reuse
+# the same connection to a region
+ec2_connections = ConnectionPool(idle_timeout=300)
+
 class EC2ConnectionProvider:
 
+    def __init__(self, region_timeout=30, page_size=200):
+        # region_timeout: seconds to wait for each page of a region's instances before leaving the rest of that region
+        # out of a listing. Time the caller spends on the instances already listed doesn't count
+        # page_size: most instances to ask EC2 for at once
+        self.region_timeout = region_timeout
+        self.page_size = page_size
+
     def ec2_connection_for_region(self, region_name, public_api_key, private_api_key):
-        return boto.ec2.connect_to_region(region_name, aws_access_key_id=public_api_key, aws_secret_access_key=private_api_key)
+        return ec2_connections.get((region_name, public_api_key, private_api_key),
+            lambda: boto.ec2.connect_to_region(region_name, aws_access_key_id=public_api_key, aws_secret_access_key=private_api_key))
 
     def get_ec2_regions(self, public_api_key, private_api_key):
         return boto.ec2.regions(aws_access_key_id=public_api_key, aws_secret_access_key=private_api_key)
 
-    def get_all_boto_instances(self, public_api_key, private_api_key):
-        for region in self.get_ec2_regions(public_api_key, private_api_key):
-            for reservation in self.ec2_connection_for_region(region.name, public_api_key, private_api_key).get_all_instances():
-                for instance in reservation.instances:
+    def get_all_boto_instances(self, public_api_key, private_api_key, region_names=None, filters=None):
+        """
+        Lists the instances of every region at once, a page at a time, yielding each page's instances as soon as they
+        arrive. Only a couple of pages per region are held waiting to be yielded, so listing a large account doesn't
+        hold every instance in memory at once. A region which fails, or whose next page doesn't arrive within
+        region_timeout seconds, is reported and the rest of it left out.
+        region_names: the regions to list, or None for every region
+        filters: EC2 filters for EC2 to list only the instances which pass
+        """
+        if region_names is None:
+            regions = [region.name for region in self.get_ec2_regions(public_api_key, private_api_key)]
+        else:
+            regions = list(region_names)
+        results = Queue.Queue(maxsize=2 * len(regions) or 1)
+        # Set once the caller stops taking instances, so listers blocked on a full queue give up
+        abandoned = threading.Event()
+
+        for region_name in regions:
+            # Daemon threads, so a region which never answers can't stop phoenix exiting
+            lister = threading.Thread(target=self._list_region,
+                args=(region_name, public_api_key, private_api_key, filters, results, abandoned))
+            lister.daemon = True
+            lister.start()
+
+        # Seconds spent waiting on each region since it was last heard from. Only time spent waiting here counts, not
+        # time the caller takes over the instances yielded
+        waited = dict((region_name, 0) for region_name in regions)
+        try:
+            while waited:
+                started_waiting = time.time()
+                try:
+                    region_name, instances, error, finished = results.get(True, max(0, self.region_timeout - max(waited.values())))
+                except Queue.Empty:
+                    region_name = None
+                for waiting_region in waited:
+                    waited[waiting_region] += time.time() - started_waiting
+
+                if region_name is None:
+                    timed_out = sorted([r for r, seconds in waited.items() if seconds >= self.region_timeout])
+                    logger.warn("Timed out listing instances in regions %s after %s seconds, they will not be included in listing" %
+                                (", ".join(timed_out), self.region_timeout))
+                    for timed_out_region in timed_out:
+                        del waited[timed_out_region]
+                    continue
+
+                if not region_name in waited:
+                    continue
+                waited[region_name] = 0
+                if finished:
+                    del waited[region_name]
+                if error:
+                    logger.warn("Unable to list instances in region %s, they will not be included in listing: %s" % (region_name, error))
+                    continue
+                for instance in instances:
                     yield instance
+        finally:
+            abandoned.set()
 
-    def connected_to_node(self, ip_address, port):
+    def _list_region(self, region_name, public_api_key, private_api_key, filters, results, abandoned):
+        try:
+            connection = self.ec2_connection_for_region(region_name, public_api_key, private_api_key)
+            next_token = None
+            while True:
+                reservations = connection.get_all_reservations(filters=filters, max_results=self.page_size, next_token=next_token)
+                next_token = reservations.next_token
+                if not self._report(results, (region_name, [instance for reservation in reservations for instance in reservation.instances],
+                                              None, not next_token), abandoned):
+                    return
+                if not next_token:
+                    return
+        except Exception as e:
+            self._report(results, (region_name, [], e, True), abandoned)
+
+    def _report(self, results, result, abandoned):
+        # Waits for room for as long as the listing is still taking pages, however slowly
+        while not abandoned.is_set():
+            try:
+                results.put(result, True, 1)
+                return True
+            except Queue.Full:
+                pass
+        logger.debug("Listing of region %s abandoned" % result[0])
+        return False
+
+    def connected_to_node(self, ip_address, port, timeout=5):
         try:
-            socket.create_connection((ip_address, port))
+            socket.create_connection((ip_address, port), timeout).close()
             return True
         except:
             return False
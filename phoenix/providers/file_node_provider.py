@@ -16,6 +16,7 @@ import os
 import yaml
 import random
 from node_predicates import all_nodes
+from phoenix.providers import node_predicates
 from phoenix.providers.address import Address
 
 class FileBackedNodeDefinition:
@@ -97,6 +98,9 @@ class FileBackedNode:
     def matches_definition(self, node_type):
         return set(self.services) == set(node_type.services)
 
+    def fingerprint(self):
+        return frozenset(self.services)
+
     def wait_for_ready(self, callback, start_up_timeout):
         callback()
 
@@ -127,14 +131,33 @@ class FileBackedNodeProvider(object):
             return self.node_ids.pop()
 
     def list(self, all_credentials, node_predicate=all_nodes):
+        return list(self.iter_nodes(all_credentials, node_predicate))
+
+    def iter_nodes(self, all_credentials, node_predicate=all_nodes):
         file_string = './fake_nodes/fake_env.yml'
         if not os.path.exists(file_string):
-            return []
+            return
 
-        f = open(file_string, 'r')
-        nodes = yaml.load(f)['nodes']
-        return filter(node_predicate, [FileBackedNode(bob[0], bob[1]['state'], bob[1]['env'], bob[1]['services'], bob[1]['env_def_name'])
-                                       for bob in nodes.items()])
+        with open(file_string, 'r') as f:
+            contents = yaml.load(f)
+        nodes = contents['nodes']
+        node_ids = nodes.keys()
+
+        conditions = node_predicates.conditions_of(node_predicate) or {}
+        if 'environment_name' in conditions and 'environment_definition_name' in conditions:
+            # Only the nodes the index holds for the environments asked for can match
+            index = _environment_index(contents)
+            node_ids = [node_id for env_def_name in conditions['environment_definition_name'] for env_name in conditions['environment_name']
+                        for node_id in index.get(_environment_key(env_def_name, env_name), []) if node_id in nodes]
+
+        for node_id in node_ids:
+            node = FileBackedNode(node_id, nodes[node_id]['state'], nodes[node_id]['env'], nodes[node_id]['services'], nodes[node_id]['env_def_name'])
+            if node_predicate(node):
+                yield node
+
+    def location_of(self, node):
+        # Every node is kept in the one file
+        return None
 
     def shutdown(self, identity):
         _change_state(identity, 'terminated')
@@ -144,28 +167,74 @@ class FileBackedNodeProvider(object):
         node_id = self.next_id()
         state = 'running'
         with open(file_string, 'w') as file:
+            contents['environments'] = _environment_index(contents)
             contents['nodes'][node_id] = { 'state' : state, 'services' : {}, 'env' : env_name, 'env_def_name' : env_def_name }
+            contents['environments'].setdefault(_environment_key(env_def_name, env_name), []).append(node_id)
             yaml.dump(contents, file)
 
         return FileBackedNode(node_id, state, env_name, [], env_def_name)
 
+    def shutdown_nodes(self, nodes):
+        for node in nodes:
+            self.shutdown(node.id())
+
+    def check_node_definitions(self, node_definitions):
+        pass
+
+    def flush_tags(self, nodes):
+        pass
+
+    def launch_batch_key(self, node_definition):
+        return None
+
+    def start_batch(self, node_definitions, env_name, env_def_name):
+        return [self.start(node_definition, env_name, env_def_name) for node_definition in node_definitions]
+
 
     def validate(self, env_name, env_values, error_list, all_credentials):
         pass
 
-    def get_running_environment(self, env_name, all_credentials):
+    def get_running_environment(self, env_name, env_template_name, all_credentials, nodes=None):
         pass
 
     def get_node_startup_timeout(self):
         pass
 
+    def get_concurrency_limit(self):
+        # Nodes are all kept in a single file, so they have to be started one at a time
+        return 1
+
+    def definition_fingerprint(self, node_definition):
+        return frozenset(node_definition.services)
+
+    def limit_to_regions_of(self, node_definitions):
+        pass
+
 file_string = './fake_nodes/fake_env.yml'
+
+def _environment_key(env_def_name, env_name):
+    return "%s/%s" % (env_def_name, env_name)
+
+def _environment_index(contents):
+    """
+    returns: map of environment key -> IDs of the environment's nodes. Files written before there was an index, or
+    with one that misses some nodes, have it rebuilt from the nodes
+    """
+    index = contents.get('environments')
+    if index is not None and sum([len(node_ids) for node_ids in index.values()]) == len(contents['nodes']):
+        return index
+
+    index = {}
+    for node_id, node in contents['nodes'].items():
+        index.setdefault(_environment_key(node['env_def_name'], node['env']), []).append(node_id)
+    return index
+
 def _get_content():
     dir_string = './fake_nodes'
     if not os.path.exists(dir_string):
         os.makedirs(dir_string)
     file_string = dir_string + '/fake_env.yml'
-    contents = {'nodes': {}, 'security_groups': [] }
+    contents = {'nodes': {}, 'security_groups': [], 'environments': {} }
     if os.path.exists(file_string):
         with open(file_string, 'r') as file:
             contents = yaml.load(file)
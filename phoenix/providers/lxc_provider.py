@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import pipes
 import random
+import re
 import string
 from fabric.context_managers import settings, hide
 from fabric.operations import run, put
@@ -23,6 +26,8 @@ from node_predicates import all_nodes
 import phoenix
 from phoenix.environment_description import Location
 from phoenix.plogging import logger
+from phoenix.utilities.utility import is_positive_integer
+from phoenix.utilities.worker_pool import fabric_env_lock
 from phoenix.providers.address import Address
 
 class LXCNodeDefinition:
@@ -38,11 +43,17 @@ class LXCNodeDefinition:
     def __str__(self):
         return "LXCNodeDefinition for %s" % self.template
 
+def definition_fingerprint(node_definition):
+    return node_definition.template, tuple(sorted(node_definition.services))
+
 class LXCNode:
-    def __init__(self, node_id, ssh_command_helper, lxc_host_name):
+    def __init__(self, node_id, ssh_command_helper, lxc_host_name, listed_tags=None, listed_state=None):
         self.node_id = node_id
         self.ssh_command_helper = ssh_command_helper
         self.lxc_host_name = lxc_host_name
+        # The tags and state the container had when it was listed, which save a round trip to the host to read them
+        self.listed_tags = listed_tags
+        self.listed_state = listed_state
 
     def __str__(self):
         return "LXC Node: %s running on %s" % (self.node_id, self.lxc_host_name)
@@ -57,10 +68,14 @@ class LXCNode:
         return {'template': self._tag('template'),'id':self.id(), 'dns_name': self.lxc_host_name, 'services':self.get_services()}
 
     def tags(self):
+        if self.listed_tags is not None:
+            return copy.deepcopy(self.listed_tags)
         tags = self.ssh_command_helper.run_command("if sudo [ -f /var/lib/lxc/%s/tags ]; then sudo cat /var/lib/lxc/%s/tags; else echo '{}'; fi" % (self.node_id, self.node_id))
         return yaml.load(tags)
 
     def state(self):
+        if self.listed_state is not None:
+            return self.listed_state
         # replace "'" with "" in order to allow yaml to parse the state
         return yaml.load(self.ssh_command_helper.run_command("sudo lxc-info -n %s" % self.node_id).replace("'", ''))['state'].lower()
 
@@ -118,6 +133,8 @@ class LXCNode:
         cur_tags = self.tags()
         cur_tags['services'][service_name] = mapped_ports
         self.ssh_command_helper.run_command("sudo sh -c \"echo '%s' > /var/lib/lxc/%s/tags\"" % (yaml.dump(cur_tags).strip(), self.node_id)) # write tags
+        if self.listed_tags is not None:
+            self.listed_tags = cur_tags
 
     def upload_file(self, file, destination='.'):
             file_name = file.split("/")[-1]
@@ -125,7 +142,12 @@ class LXCNode:
             self.ssh_command_helper.run_command("sudo scp -i /root/.ssh/id_rsa -oStrictHostKeyChecking=no /tmp/%s root@%s:%s" % (file_name, self.node_id, destination))
 
     def matches_definition(self, node_definition):
-        return self.get_services().keys() == node_definition.services and self.tags()['template'] == node_definition.template
+        return self.fingerprint() == definition_fingerprint(node_definition)
+
+    def fingerprint(self):
+        # Reads the tags once, as each read is a round trip to the LXC host
+        tags = self.tags()
+        return tags.get('template'), tuple(sorted(tags.get('services', {}).keys()))
 
     def wait_for_ready(self, callback, start_up_timeout=45):
         logger.info("Waiting for node %s to be ready" % self.id())
@@ -164,19 +186,21 @@ class LXCNode:
 
 class LXCNodeProvider(object):
 
-    def __init__(self, credentials=None, host_name=None, ssh_command_helper=None, start_up_timeout=45):
+    def __init__(self, credentials=None, host_name=None, ssh_command_helper=None, start_up_timeout=45, concurrency_limit=1):
         self.credentials = credentials
         self.host_name = host_name
         self.ssh_command_helper = ssh_command_helper
         self.start_up_timeout = start_up_timeout
+        self.concurrency_limit = concurrency_limit
         if ssh_command_helper is None and not credentials is None:
             self.ssh_command_helper = SSHCommandHelper(host_name, credentials.login, credentials.path_to_private_key())
 
     def __eq__(self, other):
-        return isinstance(other, LXCNodeProvider) and self.credentials == other.credentials
+        # The host picks which containers are listed, so providers for different hosts never share cached inventories
+        return isinstance(other, LXCNodeProvider) and self.credentials == other.credentials and self.host_name == other.host_name
 
     def __hash__(self):
-        return hash(self.credentials)
+        return hash((self.credentials, self.host_name))
 
     def __str__(self):
         return "LXCNodeProvider"
@@ -186,6 +210,8 @@ class LXCNodeProvider(object):
             error_list.append("Key 'host_name' not found for LXC in '%s' environment" % env_name)
         elif env_values['host_name'] is None or env_values['host_name'].strip() == "":
             error_list.append("Key 'host_name' not defined for LXC in '%s' environment" % env_name)
+        if 'concurrency_limit' in env_values and not is_positive_integer(env_values['concurrency_limit']):
+            error_list.append("Key 'concurrency_limit' must be a positive integer for LXC in '%s' environment" % env_name)
         if not 'credentials' in env_values:
             error_list.append("Key 'credentials' not found for LXC in '%s' environment" % env_name)
             return
@@ -198,11 +224,23 @@ class LXCNodeProvider(object):
             error_list.append("'%s' is invalid for key 'credentials' in LXC for '%s' environment" % (credential_name, env_name))
 
     def list(self, ignored_credentials = None, node_predicate = all_nodes):
-        nodes = list(set(self.ssh_command_helper.run_command("sudo lxc-ls -c1").splitlines()))
-        return filter(node_predicate, [LXCNode(x, self.ssh_command_helper, self.host_name) for x in nodes])
-
-    def get_running_environment(self, env_name, env_template_name, all_credentials):
-        nodes = self.list(all_credentials, lambda x: node_predicates.running_in_env(env_name, env_template_name)(x))
+        return list(self.iter_nodes(ignored_credentials, node_predicate))
+
+    def iter_nodes(self, ignored_credentials = None, node_predicate = all_nodes):
+        # One command lists every container with its state and tags, having the host skip containers which can't match
+        listing = self.ssh_command_helper.run_command(listing_command(node_predicates.conditions_of(node_predicate) or {}))
+        for node_id, state, tags in parse_listing(listing):
+            node = LXCNode(node_id, self.ssh_command_helper, self.host_name, tags, state)
+            if node_predicate(node):
+                yield node
+
+    def location_of(self, node):
+        return self.host_name
+
+    def get_running_environment(self, env_name, env_template_name, all_credentials, nodes=None):
+        # nodes: the running nodes of the environment, if they have already been listed
+        if nodes is None:
+            nodes = self.list(all_credentials, node_predicates.running_in_env(env_name, env_template_name))
         locations = []
         if not nodes is None and len(nodes) != 0:
             locations.append(Location(self.host_name, nodes))
@@ -233,12 +271,84 @@ class LXCNodeProvider(object):
         self.ssh_command_helper.run_commands(commands)
         return LXCNode(node_id, self.ssh_command_helper, self.host_name)
 
+    def shutdown_nodes(self, nodes):
+        for node in nodes:
+            self.shutdown(node.id())
+
+    def check_node_definitions(self, node_definitions):
+        pass
+
+    def flush_tags(self, nodes):
+        # Tags are written as services are added
+        pass
+
+    def launch_batch_key(self, lxc_node_definition):
+        # Containers are created one at a time
+        return None
+
+    def start_batch(self, lxc_node_definitions, env_name, env_def_name):
+        return [self.start(lxc_node_definition, env_name, env_def_name) for lxc_node_definition in lxc_node_definitions]
+
     def get_env_definition_translator(self):
         return phoenix.environment_description.LXCEnvironmentDefinitionTranslator()
 
     def get_node_startup_timeout(self):
         return self.start_up_timeout
 
+    def get_concurrency_limit(self):
+        return self.concurrency_limit
+
+    def definition_fingerprint(self, node_definition):
+        return definition_fingerprint(node_definition)
+
+    def limit_to_regions_of(self, node_definitions):
+        # All containers live on the one host
+        pass
+
+# Node attributes predicates can hold conditions on which are kept in each container's tags file
+TAGGED_ATTRIBUTES = ['environment_definition_name', 'environment_name']
+
+def listing_command(conditions):
+    """
+    A command printing a '=== <container> <state>' line for each container on the host, followed by its tags
+    conditions: the conditions of a node predicate, which the host uses to skip containers which can't match. A tag's
+    value only has to appear somewhere in the tags file, so the nodes listed still need checking against the predicate.
+    Values YAML might quote or escape are left for that check.
+    """
+    checks = []
+    if 'state' in conditions:
+        checks.append("sudo lxc-info -n $c | tr -d \"'\" | grep -qiE '^state: *(%s)$'" %
+                      "|".join(sorted(conditions['state'])))
+    for attribute in TAGGED_ATTRIBUTES:
+        values = list(conditions.get(attribute, []))
+        if len(values) == 1 and re.match(r'^[\w][\w .-]*$', str(values[0])):
+            checks.append("sudo grep -qF %s /var/lib/lxc/$c/tags 2>/dev/null" % pipes.quote(str(values[0])))
+
+    skip = "".join(["%s || continue; " % check for check in checks])
+    return "for c in $(sudo lxc-ls -c1 | sort -u); do %s" % skip + \
+           "echo \"=== $c $(sudo lxc-info -n $c | tr -d \"'\" | awk 'tolower($1) == \"state:\" {print tolower($2)}')\"; " + \
+           "if sudo [ -f /var/lib/lxc/$c/tags ]; then sudo cat /var/lib/lxc/$c/tags; else echo '{}'; fi; done"
+
+def parse_listing(listing):
+    """
+    Yields (container, state, tags) from the output of listing_command, parsing each container's tags only when
+    it is reached
+    """
+    container = None
+    for line in listing.splitlines():
+        if line.startswith('=== '):
+            if container:
+                yield _parsed_container(*container)
+            fields = line[4:].split()
+            container = (fields[0], fields[1] if len(fields) > 1 else None, [])
+        elif container:
+            container[2].append(line)
+    if container:
+        yield _parsed_container(*container)
+
+def _parsed_container(node_id, state, tag_lines):
+    return node_id, state, yaml.load("\n".join(tag_lines)) or {}
+
 class SSHCommandHelper():
     def __init__(self, host_name, admin_user, path_to_private_key):
         self.host_name = host_name
@@ -249,19 +359,23 @@ class SSHCommandHelper():
         return settings(host_string=self.host_name, user=self.admin_user, key_filename=self.path_to_private_key)
 
     def run_commands(self, commands):
-        with self._ssh_credentials_context():
-            for command in commands :
-                run(command)
+        with fabric_env_lock:
+            with self._ssh_credentials_context():
+                for command in commands :
+                    run(command)
 
     def run_command(self, command):
-        with self._ssh_credentials_context():
-            return run(command)
+        with fabric_env_lock:
+            with self._ssh_credentials_context():
+                return run(command)
 
     def run_command_silently(self, command):
-        with self._ssh_credentials_context():
-            with hide('running', 'stdout', 'stderr', 'status', 'aborts'):
-                return run(command)
+        with fabric_env_lock:
+            with self._ssh_credentials_context():
+                with hide('running', 'stdout', 'stderr', 'status', 'aborts'):
+                    return run(command)
 
     def put_file(self, local_file, remote_path):
-        with self._ssh_credentials_context():
-            return put(local_file, remote_path)
+        with fabric_env_lock:
+            with self._ssh_credentials_context():
+                return put(local_file, remote_path)
@@ -14,13 +14,58 @@
 
 from phoenix.plogging import logger
 
-running_nodes = lambda x: x.state() == 'running'
-started_nodes = lambda x: x.state() == 'running' or x.state() == 'pending'
-all_nodes = lambda x: True
+class NodePredicate(object):
+    """
+    A condition on nodes which providers can look inside, so that they can have their inventory pick out the nodes
+    which could match, rather than creating every node and asking it. Calling the predicate checks a node itself,
+    which providers fall back to for whatever their inventory can't filter on.
+    conditions: map of node attribute - 'environment_name', 'environment_definition_name' or 'state' - to the values
+    a matching node may have for it. A node matches when every condition holds.
+    """
+    ATTRIBUTES = ['environment_name', 'environment_definition_name', 'state']
+
+    def __init__(self, **conditions):
+        for attribute in conditions.keys():
+            if not attribute in NodePredicate.ATTRIBUTES:
+                raise StandardError("Nodes can't be filtered on %s" % attribute)
+        self.conditions = dict((attribute, frozenset(values)) for attribute, values in conditions.items())
+
+    def __call__(self, node):
+        # In a fixed order, as each attribute may be a round trip to the node
+        for attribute in NodePredicate.ATTRIBUTES:
+            if attribute in self.conditions and not getattr(node, attribute)() in self.conditions[attribute]:
+                return False
+        return True
+
+    def __and__(self, other):
+        conditions = dict(self.conditions)
+        for attribute, values in other.conditions.items():
+            conditions[attribute] = conditions[attribute] & values if attribute in conditions else values
+        return NodePredicate(**conditions)
+
+    def __eq__(self, other):
+        return isinstance(other, NodePredicate) and self.conditions == other.conditions
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(frozenset(self.conditions.items()))
+
+    def __repr__(self):
+        return "NodePredicate %s" % dict((attribute, sorted(values)) for attribute, values in self.conditions.items())
+
+def conditions_of(node_predicate):
+    """
+    returns: the conditions of a NodePredicate, or None for any other predicate, which can only be called on each node
+    """
+    if isinstance(node_predicate, NodePredicate):
+        return node_predicate.conditions
+    return None
+
+running_nodes = NodePredicate(state=['running'])
+started_nodes = NodePredicate(state=['running', 'pending'])
+all_nodes = NodePredicate()
 
 def running_in_env(env_name, env_def_name):
-    def annon(n):
-        return n.environment_name() == env_name and\
-               n.environment_definition_name() == env_def_name and\
-               n.state() == 'running'
-    return annon
\ No newline at end of file
+    return NodePredicate(environment_name=[env_name], environment_definition_name=[env_def_name], state=['running'])
@@ -97,11 +97,18 @@ class NoopNodeProvider(object):
         return str(self.inner_provider)
 
     def list(self, all_credentials, node_predicate=all_nodes):
-        existing_nodes = [create_existing_noop_node(self.actions, node)
-                          for node in self.inner_provider.list(all_credentials, node_predicate)
-                          if node.id() not in self.shutdown_node_ids]
+        return list(self.iter_nodes(all_credentials, node_predicate))
 
-        return existing_nodes + self.new_nodes
+    def iter_nodes(self, all_credentials, node_predicate=all_nodes):
+        for node in self.inner_provider.iter_nodes(all_credentials, node_predicate):
+            if node.id() not in self.shutdown_node_ids:
+                yield create_existing_noop_node(self.actions, node)
+
+        for node in self.new_nodes:
+            yield node
+
+    def location_of(self, node):
+        return self.inner_provider.location_of(node)
 
     def shutdown(self, identity):
         action = ShutdownAction(identity)
@@ -118,11 +125,30 @@ class NoopNodeProvider(object):
         self.new_nodes.append(new_node)
         return new_node
 
+    def shutdown_nodes(self, nodes):
+        for node in nodes:
+            self.shutdown(node.id())
+
+    def check_node_definitions(self, node_definitions):
+        # Checking asks the cloud about each image and may write the image cache, and a dry run shouldn't do either
+        pass
+
+    def flush_tags(self, nodes):
+        # Adding services to tags is only recorded, so there's nothing to write
+        pass
+
+    def launch_batch_key(self, node_definition):
+        # Each new node is reported on separately
+        return None
+
+    def start_batch(self, node_definitions, env_name, env_def_name):
+        return [self.start(node_definition, env_name, env_def_name) for node_definition in node_definitions]
+
     def validate(self, env_name, env_values, error_list, all_credentials):
         self.inner_provider.validate(env_name, env_values, error_list, all_credentials)
 
-    def get_running_environment(self, env_name, all_credentials):
-        self.inner_provider.get_running_environment(env_name, all_credentials)
+    def get_running_environment(self, env_name, env_template_name, all_credentials, nodes=None):
+        return self.inner_provider.get_running_environment(env_name, env_template_name, all_credentials, nodes)
 
     def noop_actions_string(self):
         return str(self.actions)
@@ -130,6 +156,15 @@ class NoopNodeProvider(object):
     def get_node_startup_timeout(self):
         return 0
 
+    def get_concurrency_limit(self):
+        return 1
+
+    def definition_fingerprint(self, node_definition):
+        return self.inner_provider.definition_fingerprint(node_definition)
+
+    def limit_to_regions_of(self, node_definitions):
+        self.inner_provider.limit_to_regions_of(node_definitions)
+
 def create_new_noop_node(actions, env_name, env_def_name, id):
     tags = { 'env_name' : env_name,
              'env_def_name' : env_def_name,
@@ -189,6 +224,10 @@ class NewNoopNode(object):
         # This method is not currently used for new Nodes
         return False
 
+    def fingerprint(self):
+        # New nodes never match a definition
+        return ('new node', self._id)
+
     def wait_for_ready(self, callback, start_up_timeout):
         callback()
 
@@ -245,6 +284,9 @@ class ExistingNoopNode(object):
     def matches_definition(self, node_definition):
         return self.inner_node.matches_definition(node_definition)
 
+    def fingerprint(self):
+        return self.inner_node.fingerprint()
+
     def wait_for_ready(self, callback, start_up_timeout):
         self.inner_node.wait_for_ready(callback, start_up_timeout)
 
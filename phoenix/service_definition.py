@@ -64,6 +64,19 @@ def service_definitions_from_yaml(yaml_string, abs_path_to_config):
 
     return definition_map
 
+def service_dependencies(service_definitions):
+    """
+    Works out which services talk to which from their connectivity - if mongo allows hello_world in, then
+    hello_world depends on mongo.
+    returns: map of service name -> set of the names of services it depends on
+    """
+    dependencies = dict((service_name, set()) for service_name in service_definitions)
+    for service_name, definition in service_definitions.items():
+        for allowed in definition.allowed_services():
+            if allowed in dependencies and allowed != service_name:
+                dependencies[allowed].add(service_name)
+    return dependencies
+
 class ServiceDefinition:
     def __init__(self, name, configuration, service_configurator, abs_config_path):
         """
@@ -93,11 +106,22 @@ class ServiceDefinition:
 
         return obj
 
+    def allowed_services(self):
+        # Everything listed under 'allowed' - this includes WORLD and IP ranges as well as service names
+        allowed = []
+        for connectivity in self.configuration.get('connectivity', None) or []:
+            values = connectivity.dict if isinstance(connectivity, DynamicDictionary) else connectivity
+            allowed.extend(values.get('allowed', None) or [])
+        return allowed
+
     def get_abs_config_path(self):
         return self.abs_config_path
 
-    def apply_on(self, node, service_to_dns):
-        self.service_configurator.config(node, self, service_to_dns)
+    def apply_on(self, node, service_to_dns, journal=None):
+        """
+        journal: LaunchJournal of the launch applying the service, for configurators which can skip steps already done
+        """
+        self.service_configurator.config(node, self, service_to_dns, journal=journal)
 
     def bundle(self, attribute, bundle_name):
         local("cd %s && tar cfz /tmp/%s %s" % (self.abs_config_path, bundle_name, self.configuration[attribute]))
@@ -36,7 +36,7 @@ setup(
             ['pho = phoenix.pho:main']},
     url='http://thoughtworks.com/',
     install_requires=[
-        "boto >= 2.3.0",
+        "boto >= 2.13.0",
         "texttable >= 0.8.1",
         "fabric >= 1.4.1",
         "pyyaml >= 3.0.8",
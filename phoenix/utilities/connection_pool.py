@@ -0,0 +1,72 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from phoenix.plogging import logger
+
+class ConnectionPool(object):
+    """
+    Keeps connections open for reuse, keyed by whatever identifies what they are connected to. Connections which
+    haven't been used for idle_timeout seconds are closed and dropped the next time the pool is used.
+    """
+
+    def __init__(self, idle_timeout=300, clock=time.time):
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.connections = {}
+        self.last_used = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, connect):
+        """
+        Returns the pooled connection for key, calling connect to open one if there isn't one
+        """
+        with self.lock:
+            now = self.clock()
+            self._evict_idle(now)
+
+            if key in self.connections:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.connections[key] = connect()
+            self.last_used[key] = now
+            return self.connections[key]
+
+    def stats(self):
+        return {'open': len(self.connections), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        with self.lock:
+            for key in self.connections.keys():
+                self._close(key)
+
+    def _evict_idle(self, now):
+        for key, last_used in self.last_used.items():
+            if now - last_used > self.idle_timeout:
+                self.evictions += 1
+                self._close(key)
+
+    def _close(self, key):
+        connection = self.connections.pop(key)
+        del self.last_used[key]
+        try:
+            connection.close()
+        except Exception as e:
+            # Keys may hold credentials, so they're kept out of the log
+            logger.debug("Unable to close idle connection: %s" % e)
@@ -0,0 +1,138 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import select
+import socket
+import threading
+import time
+from phoenix.plogging import logger
+
+class _Target(object):
+    def __init__(self, address):
+        self.address = address
+        self.open = threading.Event()
+        self.waiters = 0
+        self.next_attempt = 0
+        self.interval = None
+        self.socket = None
+        self.connect_deadline = None
+
+class PortProber(object):
+    """
+    Waits for ports on many hosts to accept connections, trying them all from a single thread with non-blocking
+    connects. A connect which hasn't completed within connect_timeout is abandoned, and each host is retried after
+    a delay which grows from min_interval to max_interval while it stays closed.
+    """
+
+    def __init__(self, connect_timeout=5, min_interval=1, max_interval=10):
+        self.connect_timeout = connect_timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.targets = {}
+        self.lock = threading.Lock()
+        self.probing = False
+
+    def wait_until_open(self, host, port, timeout):
+        """
+        Blocks until host accepts connections on port, or timeout seconds have passed
+        returns: whether the port is open
+        """
+        address = (host, port)
+        with self.lock:
+            if not address in self.targets:
+                self.targets[address] = _Target(address)
+            target = self.targets[address]
+            target.waiters += 1
+            if not self.probing:
+                self.probing = True
+                prober = threading.Thread(target=self._probe)
+                prober.daemon = True
+                prober.start()
+
+        target.open.wait(timeout)
+
+        with self.lock:
+            target.waiters -= 1
+            if not target.waiters and self.targets.get(address) is target:
+                # Its socket may be being selected on, so the prober closes it
+                del self.targets[address]
+        return target.open.is_set()
+
+    def _probe(self):
+        while True:
+            with self.lock:
+                targets = [t for t in self.targets.values() if not t.open.is_set()]
+                if not targets:
+                    self.probing = False
+                    return
+
+                now = time.time()
+                for target in targets:
+                    if target.socket is None and target.next_attempt <= now:
+                        self._connect(target, now)
+                    elif target.socket is not None and target.connect_deadline <= now:
+                        logger.debug("Timed out connecting to %s:%s" % target.address)
+                        self._retry_later(target, now)
+
+                connecting = dict((t.socket, t) for t in targets if t.socket is not None)
+                wake_at = min([t.connect_deadline for t in connecting.values()] +
+                              [t.next_attempt for t in targets if t.socket is None] + [now + self.min_interval])
+
+            # Wait for a connect to complete, or until the next attempt or connect deadline is due
+            wait = min(max(0, wake_at - time.time()), self.min_interval)
+            if connecting:
+                _, writable, failed = select.select([], connecting.keys(), connecting.keys(), wait)
+            else:
+                writable, failed = [], []
+                time.sleep(wait)
+
+            with self.lock:
+                now = time.time()
+                for target in connecting.values():
+                    if not self.targets.get(target.address) is target:
+                        self._close(target)
+
+                for connection in set(writable + failed):
+                    target = connecting[connection]
+                    if target.socket is not connection:
+                        continue
+                    error = connection.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if error == 0:
+                        self._close(target)
+                        target.open.set()
+                    else:
+                        logger.debug("Unable to connect to %s:%s yet: %s" % (target.address + (errno.errorcode.get(error, error),)))
+                        self._retry_later(target, now)
+
+    def _connect(self, target, now):
+        target.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        target.socket.setblocking(0)
+        target.connect_deadline = now + self.connect_timeout
+        error = target.socket.connect_ex(target.address)
+        if error == 0:
+            self._close(target)
+            target.open.set()
+        elif error not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self._retry_later(target, now)
+
+    def _retry_later(self, target, now):
+        self._close(target)
+        target.interval = self.min_interval if target.interval is None else min(target.interval * 2, self.max_interval)
+        target.next_attempt = now + target.interval
+
+    def _close(self, target):
+        if target.socket is not None:
+            target.socket.close()
+            target.socket = None
@@ -26,3 +26,6 @@ def get_class_from_fully_qualified_string( kls ):
     except AttributeError as (ae):
         error_message = "Unable to find class %s, %s" % (kls, ae)
         raise StandardError(error_message)
+
+def is_positive_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
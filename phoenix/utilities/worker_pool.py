@@ -0,0 +1,218 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+from functools import partial
+import multiprocessing
+import Queue
+import sys
+import threading
+import traceback
+import fabric.state
+from fabric.network import disconnect_all
+from phoenix.plogging import logger
+
+# Fabric keeps the current host in a process wide env, so commands run from several threads have to take turns
+fabric_env_lock = threading.RLock()
+
+class TaskOutcome(object):
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+
+    def __repr__(self):
+        return "TaskOutcome result:%s error:%s" % (self.result, self.error)
+
+    def succeeded(self):
+        return self.error is None
+
+def find_cycle(keys, dependencies):
+    """
+    Returns a list of keys forming a dependency cycle (first key repeated at the end), or None if there isn't one
+    keys: the keys to check
+    dependencies: map of key -> keys it depends on. Dependencies on keys not in 'keys' are ignored
+    """
+    keys = list(keys)
+    known_keys = set(keys)
+    visiting = []
+    visited = set()
+
+    def visit(key):
+        if key in visiting:
+            return visiting[visiting.index(key):] + [key]
+        if key in visited:
+            return None
+
+        visiting.append(key)
+        for dependency in dependencies.get(key, []):
+            if dependency in known_keys:
+                cycle = visit(dependency)
+                if cycle:
+                    return cycle
+        visiting.pop()
+        visited.add(key)
+        return None
+
+    for key in keys:
+        cycle = visit(key)
+        if cycle:
+            return cycle
+    return None
+
+class WorkerPool(object):
+    """
+    Runs tasks on at most max_workers threads at once. With a single worker every task runs in the calling thread,
+    in the order given, so behaviour is the same as a plain loop.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max(1, max_workers or 1)
+
+    def map(self, func, items):
+        """
+        Calls func with each item, returning a list of TaskOutcome in the same order as items
+        """
+        outcomes = self.run([(index, partial(func, item)) for index, item in enumerate(items)])
+        return [outcomes[index] for index in range(len(items))]
+
+    def run(self, tasks, dependencies=None):
+        """
+        tasks: list of (key, callable) pairs - the callables take no arguments
+        dependencies: map of key -> keys which must complete successfully before that task is started
+        Tasks whose dependencies fail are never started; their outcome carries an error naming the failed dependency.
+        returns: map of key -> TaskOutcome
+        """
+        if not dependencies: dependencies = {}
+
+        keys = [key for key, _ in tasks]
+        callables = dict(tasks)
+
+        cycle = find_cycle(keys, dependencies)
+        if cycle:
+            raise StandardError("Dependency cycle detected: %s" % " -> ".join([str(x) for x in cycle]))
+
+        waiting_on = dict((key, set(dependencies.get(key, [])) & set(keys)) for key in keys)
+        dependents = defaultdict(lambda: [])
+        for key in keys:
+            for dependency in waiting_on[key]:
+                dependents[dependency].append(key)
+
+        outcomes = {}
+        ready = [key for key in keys if not waiting_on[key]]
+        completed = Queue.Queue()
+        running = 0
+
+        def skip_dependents_of(failed_key):
+            for dependent in dependents[failed_key]:
+                if dependent not in outcomes:
+                    outcomes[dependent] = TaskOutcome(error=StandardError("Not run as %s failed" % (failed_key,)))
+                    skip_dependents_of(dependent)
+
+        while ready or running:
+            while ready and running < self.max_workers:
+                key = ready.pop(0)
+                running += 1
+                self._start(key, callables[key], completed)
+
+            key, outcome = self._next_completed(completed)
+            running -= 1
+            outcomes[key] = outcome
+
+            if not outcome.succeeded():
+                skip_dependents_of(key)
+                continue
+
+            for dependent in dependents[key]:
+                waiting_on[dependent].discard(key)
+                if not waiting_on[dependent] and dependent not in outcomes:
+                    ready.append(dependent)
+
+        return outcomes
+
+    def _start(self, key, func, completed):
+        if self.max_workers == 1:
+            _execute(key, func, completed)
+        else:
+            worker = threading.Thread(target=_execute, args=(key, func, completed))
+            worker.daemon = True
+            worker.start()
+
+    def _next_completed(self, completed):
+        # Blocking on a Queue without a timeout can't be interrupted with Ctrl-C in python 2
+        while True:
+            try:
+                return completed.get(True, 1)
+            except Queue.Empty:
+                pass
+
+def _execute(key, func, completed):
+    try:
+        outcome = TaskOutcome(result=func())
+    except Exception as e:
+        logger.debug("Task %s failed: %s" % (key, "".join(traceback.format_exception(*sys.exc_info()))))
+        outcome = TaskOutcome(error=e)
+    completed.put((key, outcome))
+
+def raise_on_failures(outcomes, message):
+    """
+    Raises a single exception describing every failed outcome
+    outcomes: map of key -> TaskOutcome
+    message: description of what was being done, used as the start of the exception message
+    """
+    failures = ["%s: %s" % (key, outcome.error) for key, outcome in outcomes.items() if not outcome.succeeded()]
+    if len(failures):
+        raise StandardError(message + ",\n" + ",\n".join(failures))
+
+def call_in_subprocess(func):
+    """
+    Calls func in a forked process, raising a StandardError here if it fails. Fabric keeps the host it is talking
+    to in a process wide env, so remote commands for several nodes can only run side by side in separate processes -
+    the same approach Fabric's own parallel execution takes.
+    returns: what func returned, which has to be picklable
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_call_and_report, args=(func, sender))
+    # A lock held by another thread when we fork would never be released in the child, so the fork waits for it
+    with fabric_env_lock:
+        process.start()
+    sender.close()
+
+    try:
+        error, result = receiver.recv()
+    except EOFError:
+        error, result = "Process %s exited without reporting whether it succeeded" % process.pid, None
+    finally:
+        receiver.close()
+        process.join()
+
+    if error:
+        raise StandardError(error)
+    return result
+
+def _call_and_report(func, sender):
+    # The parent may have been logging from another thread when we forked, and its SSH connections can't be shared
+    for handler in logger.handlers:
+        handler.createLock()
+    fabric.state.connections.clear()
+    # Taken by this thread for the fork, in the child as in the parent
+    fabric_env_lock.release()
+
+    try:
+        sender.send((None, func()))
+    except (Exception, SystemExit) as e:
+        logger.debug("".join(traceback.format_exception(*sys.exc_info())))
+        sender.send((str(e) or repr(e), None))
+    finally:
+        sender.close()
+        disconnect_all()
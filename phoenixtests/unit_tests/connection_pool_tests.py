@@ -0,0 +1,48 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from phoenix.utilities.connection_pool import ConnectionPool
+from phoenixtests.unit_tests.stubs import StubClock
+
+class StubConnection:
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class ConnectionPoolTests(unittest.TestCase):
+
+    def test_should_reuse_the_connection_for_a_key(self):
+        pool = ConnectionPool()
+
+        connections = [pool.get(key, lambda key=key: StubConnection(key)) for key in ['us-east-1', 'eu-west-1'] * 250]
+
+        self.assertEqual(2, len(set(connections)))
+        self.assertEqual({'open': 2, 'hits': 498, 'misses': 2, 'evictions': 0}, pool.stats())
+
+    def test_should_close_connections_which_have_been_idle_too_long(self):
+        clock = StubClock()
+        pool = ConnectionPool(idle_timeout=60, clock=clock)
+        idle_connection = pool.get('us-east-1', lambda: StubConnection('us-east-1'))
+        clock.now = 30
+        busy_connection = pool.get('eu-west-1', lambda: StubConnection('eu-west-1'))
+        clock.now = 61
+
+        self.assertIs(busy_connection, pool.get('eu-west-1', lambda: StubConnection('eu-west-1')))
+        self.assertTrue(idle_connection.closed)
+        self.assertIsNot(idle_connection, pool.get('us-east-1', lambda: StubConnection('us-east-1')))
+        self.assertEqual(1, pool.stats()['evictions'])
@@ -14,18 +14,24 @@
 
 import os
 import shutil
+import tempfile
+import threading
+import time
 import unittest
 from itertools import chain
 from mockito.mocking import mock
 from mockito.mockito import when, verify
 from phoenix.providers.address import Address
 import yaml
-from phoenix import service_definition, fabfile, node_config
+from phoenix import service_definition, fabfile, node_config, launch_journal
 from phoenix.environment_definition import environment_definitions_from_yaml, EnvironmentDefinition
+from phoenix.launch_journal import LaunchJournal
 from phoenix.configurators.fake_service_configurator import FakeServiceConfigurator
 from phoenix.providers import FileBackedNodeProvider
+from phoenix.providers.file_node_provider import FileBackedNodeDefinition
 from phoenix.service_definition import DynamicDictionary
 from phoenix.hooks.elb_hook import ELBHook
+from phoenixtests.unit_tests.stubs import Rendezvous, StubNode
 
 service_definitions = {
     'apache': service_definition.ServiceDefinition('apache', {'name': 'apache', 'connectivity': [ DynamicDictionary( {'ports' : [ 80 ]} ) ] }, FakeServiceConfigurator(), None),
@@ -42,10 +48,203 @@ class SimpleNodeDefinition:
         self.role = "WhyDoWeNeedThis?"
         self.services = services
 
+class ConcurrencyRecordingProvider:
+    def __init__(self, concurrency_limit):
+        self.concurrency_limit = concurrency_limit
+        self.running_starts = 0
+        self.max_concurrent_starts = 0
+        self.lock = threading.Lock()
+
+    def start(self, node_definition, env_name, env_def_name):
+        with self.lock:
+            self.running_starts += 1
+            self.max_concurrent_starts = max(self.max_concurrent_starts, self.running_starts)
+        time.sleep(0.05)
+        with self.lock:
+            self.running_starts -= 1
+        return StubNode(node_definition)
+
+    def launch_batch_key(self, node_definition):
+        return None
+
+    def start_batch(self, node_definitions, env_name, env_def_name):
+        return [self.start(node_definition, env_name, env_def_name) for node_definition in node_definitions]
+
+    def get_concurrency_limit(self):
+        return self.concurrency_limit
+
+    def check_node_definitions(self, node_definitions):
+        pass
+
+class BatchingProvider:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def launch_batch_key(self, node_definition):
+        return tuple(sorted(node_definition.services))
+
+    def start_batch(self, node_definitions, env_name, env_def_name):
+        self.batch_sizes.append(len(node_definitions))
+        return [StubNode(node_definition) for node_definition in node_definitions]
+
+    def get_concurrency_limit(self):
+        return 2
+
+    def check_node_definitions(self, node_definitions):
+        pass
+
+class SlowTerminatedHook:
+    def __init__(self):
+        self.terminated = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def service_terminated(self, service_name, node):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.2)
+        with self.lock:
+            self.running -= 1
+            self.terminated.append(node.id())
+
+class ConcurrentFileBackedNodeProvider(FileBackedNodeProvider):
+    def get_concurrency_limit(self):
+        return 2
+
+class SlowStartingNode:
+    def __init__(self, node_id, seconds_to_start, starts=True, rendezvous=None):
+        self.node_id = node_id
+        self.seconds_to_start = seconds_to_start
+        self.starts = starts
+        self.rendezvous = rendezvous
+
+    def id(self):
+        return self.node_id
+
+    def wait_for_ready(self, callback, start_up_timeout):
+        if self.rendezvous and not self.rendezvous.arrive():
+            raise Exception("Node %s was waited for on its own" % self.node_id)
+        time.sleep(self.seconds_to_start)
+        if not self.starts:
+            raise Exception("Node %s is not running" % self.node_id)
+        callback()
+
+class RecordingServiceConfigurator:
+    # Writes to a file rather than memory, as services may be configured in other processes
+    def __init__(self, record_file, seconds_to_apply=0, failing_services=None):
+        self.record_file = record_file
+        self.seconds_to_apply = seconds_to_apply
+        self.failing_services = failing_services or []
+
+    def config(self, node, service_definition, settings, journal=None):
+        self._record("start", service_definition.name, node)
+        time.sleep(self.seconds_to_apply)
+        if service_definition.name in self.failing_services:
+            raise Exception("Unable to apply %s" % service_definition.name)
+        self._record("end", service_definition.name, node)
+
+    def _record(self, event, service_name, node):
+        with open(self.record_file, 'a') as f:
+            f.write("%s %s %s\n" % (event, service_name, node.id()))
+
+    def recorded(self):
+        with open(self.record_file, 'r') as f:
+            return [line.split() for line in f.read().splitlines()]
+
+class SettingsRecordingServiceConfigurator:
+    def __init__(self):
+        self.settings = {}
+        self.journals = {}
+
+    def config(self, node, service_definition, settings, journal=None):
+        self.settings[(service_definition.name, node.id())] = settings['settings']
+        self.journals[(service_definition.name, node.id())] = journal
+        self.settings_keys = settings.keys()
+
+class BootstrappingServiceConfigurator:
+    def config(self, node, service_definition, settings, journal=None):
+        journal.record(node.id(), launch_journal.BOOTSTRAPPED)
+
+class StubProvider:
+    def __init__(self, concurrency_limit=1):
+        self.concurrency_limit = concurrency_limit
+
+    def get_concurrency_limit(self):
+        return self.concurrency_limit
+
+    def flush_tags(self, nodes):
+        pass
+
+    def check_node_definitions(self, node_definitions):
+        pass
+
+    def definition_fingerprint(self, node_definition):
+        return tuple(sorted(node_definition.services))
+
+def connected_service_definitions(configurator):
+    return {
+        'web': service_definition.ServiceDefinition('web', {'connectivity': [{'ports': [80], 'allowed': ['WORLD']}]}, configurator, None),
+        'app': service_definition.ServiceDefinition('app', {'connectivity': [{'ports': [8080], 'allowed': ['web']}]}, configurator, None),
+        'db': service_definition.ServiceDefinition('db', {'connectivity': [{'ports': [27017], 'allowed': ['app']}]}, configurator, None),
+        'cache': service_definition.ServiceDefinition('cache', {'connectivity': [{'ports': [11211], 'allowed': ['app']}]}, configurator, None)}
+
+class PipelineNodeDefinition:
+    def __init__(self, node_id, services, seconds_to_start=0, starts=True):
+        self.node_id = node_id
+        self.services = services
+        self.seconds_to_start = seconds_to_start
+        self.starts = starts
+
+class PipelineNode:
+    def __init__(self, node_definition, record_file):
+        self.node_definition = node_definition
+        self.record_file = record_file
+        self.services = {}
+
+    def id(self):
+        return self.node_definition.node_id
+
+    def wait_for_ready(self, callback, start_up_timeout):
+        time.sleep(self.node_definition.seconds_to_start)
+        if not self.node_definition.starts:
+            raise Exception("Node %s is not running" % self.id())
+        with open(self.record_file, 'a') as f:
+            f.write("ready - %s\n" % self.id())
+        callback()
+
+    def add_service_to_tags(self, service_name, connectivity):
+        self.services[service_name] = {80: 80}
+
+    def address(self):
+        return Address(self.id(), self.services)
+
+class PipelineProvider(StubProvider):
+    def __init__(self, record_file, concurrency_limit=1):
+        StubProvider.__init__(self, concurrency_limit)
+        self.record_file = record_file
+
+    def list(self, all_credentials, node_predicate):
+        return []
+
+    def start(self, node_definition, env_name, env_def_name):
+        return PipelineNode(node_definition, self.record_file)
+
+    def launch_batch_key(self, node_definition):
+        return None
+
+    def start_batch(self, node_definitions, env_name, env_def_name):
+        return [self.start(node_definition, env_name, env_def_name) for node_definition in node_definitions]
+
+    def get_node_startup_timeout(self):
+        return 1
+
 class EnvironmentDefinitionTests(unittest.TestCase):
 
     def setUp(self):
         self.tearDown()
+        self.record_files = []
 
     def nodes(self):
         return self.fake_env()['nodes'].values()
@@ -59,6 +258,14 @@ class EnvironmentDefinitionTests(unittest.TestCase):
         path = './fake_nodes'
         if os.path.exists(path):
             shutil.rmtree(path)
+        for record_file in getattr(self, 'record_files', []):
+            os.remove(record_file)
+
+    def record_file(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.record_files.append(path)
+        return path
 
     def test_can_load_environment_from_yaml(self):
         single_service_yaml = """
@@ -119,6 +326,265 @@ class EnvironmentDefinitionTests(unittest.TestCase):
         self.assertEquals(fake_env[1]["settings"], environment_settings)
         self.assertEquals(fake_env[2]["settings"], environment_settings)
 
+    def test_should_start_nodes_concurrently_up_to_the_provider_concurrency_limit(self):
+        provider = ConcurrencyRecordingProvider(2)
+        node_definitions = [SimpleNodeDefinition(services=['apache']), SimpleNodeDefinition(services=['apache', 'my_app']),
+                            SimpleNodeDefinition(services=['my_app'])]
+        environment_definition = EnvironmentDefinition('dev', provider, service_definitions, node_definitions, all_credentials, 'some_def')
+
+        service_to_nodes = environment_definition._provision_nodes(node_definitions)
+
+        self.assertEqual(2, provider.max_concurrent_starts)
+        self.assertEqual(node_definitions[:2], [n.id() for n in service_to_nodes['apache']])
+        self.assertEqual(node_definitions[1:], [n.id() for n in service_to_nodes['my_app']])
+
+    def test_should_start_identical_nodes_together(self):
+        provider = BatchingProvider()
+        node_definitions = [SimpleNodeDefinition(services=['apache']), SimpleNodeDefinition(services=['my_app']),
+                            SimpleNodeDefinition(services=['apache'])]
+        environment_definition = EnvironmentDefinition('dev', provider, service_definitions, node_definitions, all_credentials, 'some_def')
+
+        service_to_nodes = environment_definition._provision_nodes(node_definitions)
+
+        self.assertEqual([1, 2], sorted(provider.batch_sizes))
+        self.assertEqual([node_definitions[0], node_definitions[2]], [n.id() for n in service_to_nodes['apache']])
+        self.assertEqual([node_definitions[1]], [n.id() for n in service_to_nodes['my_app']])
+
+    def test_should_wait_for_all_nodes_to_be_ready_at_the_same_time(self):
+        rendezvous = Rendezvous(3)
+        nodes = [SlowStartingNode(node_id, 0, rendezvous=rendezvous) for node_id in ['1', '2', '3']]
+        environment_definition = self.EnvironmentBuilder().build()
+
+        readiness = environment_definition._block_until_all_nodes_are_ready(nodes)
+
+        self.assertTrue(all([readiness[node].succeeded() for node in nodes]))
+
+    def test_should_report_nodes_which_fail_to_become_ready_without_stopping_on_the_first(self):
+        nodes = [SlowStartingNode('1', 0, starts=False), SlowStartingNode('2', 0.1)]
+        environment_definition = self.EnvironmentBuilder().build()
+
+        readiness = environment_definition._block_until_all_nodes_are_ready(nodes)
+
+        self.assertEqual("Node 1 is not running", str(readiness[nodes[0]].error))
+        self.assertTrue(readiness[nodes[1]].succeeded())
+
+    def configure(self, configurator, service_to_nodes, concurrency_limit=1, service_definitions_to_use=None):
+        service_definitions_to_use = service_definitions_to_use or connected_service_definitions(configurator)
+        environment_definition = EnvironmentDefinition('dev', StubProvider(concurrency_limit), service_definitions_to_use, [],
+            all_credentials, 'some_def')
+        environment_definition.configure_services(service_to_nodes, {})
+
+    def test_should_configure_services_after_the_services_they_talk_to(self):
+        configurator = RecordingServiceConfigurator(self.record_file())
+        web, app, db = StubNode('web-1'), StubNode('app-1'), StubNode('db-1')
+
+        self.configure(configurator, {'web': [web], 'app': [app], 'db': [db]})
+
+        applied = [service for event, service, node in configurator.recorded() if event == 'end']
+        self.assertEqual(['db', 'app', 'web'], applied)
+
+    def test_should_configure_independent_services_concurrently(self):
+        configurator = RecordingServiceConfigurator(self.record_file(), seconds_to_apply=0.5)
+
+        self.configure(configurator, {'db': [StubNode('db-1')], 'cache': [StubNode('cache-1')], 'app': [StubNode('app-1')]},
+            concurrency_limit=3)
+
+        events = [(event, service) for event, service, node in configurator.recorded()]
+        self.assertEqual(set([('start', 'db'), ('start', 'cache')]), set(events[:2]))
+        self.assertEqual([('start', 'app'), ('end', 'app')], events[-2:])
+
+    def test_should_only_apply_one_service_at_a_time_to_a_node(self):
+        configurator = RecordingServiceConfigurator(self.record_file(), seconds_to_apply=0.2)
+        node = StubNode('node-1')
+
+        self.configure(configurator, {'db': [node], 'cache': [node]}, concurrency_limit=2)
+
+        self.assertEqual(['start', 'end', 'start', 'end'], [event for event, service, node_id in configurator.recorded()])
+
+    def test_should_not_configure_services_depending_on_a_service_which_failed(self):
+        configurator = RecordingServiceConfigurator(self.record_file(), failing_services=['db'])
+
+        with self.assertRaisesRegexp(StandardError, "Service app on node app-1: Not run as \\('db', 'db-1'\\) failed"):
+            self.configure(configurator, {'db': [StubNode('db-1')], 'app': [StubNode('app-1')], 'cache': [StubNode('cache-1')]})
+
+        applied = [service for event, service, node in configurator.recorded() if event == 'end']
+        self.assertEqual(['cache'], applied)
+
+    def test_should_give_configurators_the_launch_journal_apart_from_the_settings(self):
+        configurator = SettingsRecordingServiceConfigurator()
+        environment_definition = EnvironmentDefinition('dev', StubProvider(), connected_service_definitions(configurator), [],
+            all_credentials, 'some_def')
+
+        environment_definition.configure_services({'db': [StubNode('db-1')]}, {})
+
+        self.assertEqual(['settings'], configurator.settings_keys)
+        self.assertIs(environment_definition.journal, configurator.journals[('db', 'db-1')])
+
+    def test_should_not_hang_when_forking_while_another_thread_holds_the_journal_lock(self):
+        environment_definition = EnvironmentDefinition('dev', StubProvider(2), connected_service_definitions(BootstrappingServiceConfigurator()),
+            [], all_credentials, 'some_def')
+        holding = threading.Event()
+        def hold_lock():
+            with environment_definition.journal.lock:
+                holding.set()
+                time.sleep(0.3)
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        holding.wait()
+
+        configurer = threading.Thread(target=environment_definition._configure_service_on_node, args=('db', StubNode('db-1'), {}, True))
+        configurer.daemon = True
+        configurer.start()
+        configurer.join(5)
+        holder.join()
+
+        self.assertFalse(configurer.is_alive())
+        self.assertTrue(environment_definition.journal.completed('db-1', launch_journal.BOOTSTRAPPED))
+
+    def test_should_refuse_to_configure_services_with_cyclic_dependencies(self):
+        configurator = RecordingServiceConfigurator(self.record_file())
+        cyclic_service_definitions = {
+            'a': service_definition.ServiceDefinition('a', {'connectivity': [{'ports': [1], 'allowed': ['b']}]}, configurator, None),
+            'b': service_definition.ServiceDefinition('b', {'connectivity': [{'ports': [2], 'allowed': ['a']}]}, configurator, None)}
+
+        with self.assertRaisesRegexp(StandardError, "Services have cyclic dependencies through their connectivity"):
+            self.configure(configurator, {'a': [StubNode('a-1')], 'b': [StubNode('b-1')]},
+                service_definitions_to_use=cyclic_service_definitions)
+
+        self.assertEqual([], configurator.recorded())
+
+    def test_should_not_start_any_node_when_services_have_cyclic_dependencies(self):
+        configurator = RecordingServiceConfigurator(self.record_file())
+        cyclic_service_definitions = {
+            'a': service_definition.ServiceDefinition('a', {'connectivity': [{'ports': [1], 'allowed': ['b']}]}, configurator, None),
+            'b': service_definition.ServiceDefinition('b', {'connectivity': [{'ports': [2], 'allowed': ['a']}]}, configurator, None)}
+        provider = PipelineProvider(configurator.record_file)
+        started = []
+        provider.start_batch = lambda node_definitions, env_name, env_def_name: started.extend(node_definitions)
+        environment_definition = EnvironmentDefinition('dev', provider, cyclic_service_definitions,
+            [PipelineNodeDefinition('a-1', ['a']), PipelineNodeDefinition('b-1', ['b'])], all_credentials, 'some_def')
+
+        with self.assertRaisesRegexp(StandardError, "Services have cyclic dependencies through their connectivity: a -> b -> a"):
+            environment_definition.launch()
+
+        self.assertEqual([], started)
+
+    def launch_pipelined(self, configurator, *node_definitions):
+        provider = PipelineProvider(configurator.record_file)
+        environment_definition = EnvironmentDefinition('dev', provider, connected_service_definitions(configurator),
+            list(node_definitions), all_credentials, 'some_def')
+        environment_definition.launch(pipelined=True)
+
+    def test_pipelined_launch_gives_services_waiting_for_all_their_nodes_the_settings_of_a_normal_launch(self):
+        record_file = self.record_file()
+
+        def settings_applied(pipelined):
+            configurator = SettingsRecordingServiceConfigurator()
+            service_definitions_to_use = connected_service_definitions(configurator)
+            service_definitions_to_use['app'].configuration['wait_for_whole_service'] = True
+            environment_definition = EnvironmentDefinition('dev', PipelineProvider(record_file), service_definitions_to_use,
+                [PipelineNodeDefinition('app-1', ['app']), PipelineNodeDefinition('app-2', ['app'], seconds_to_start=0.2),
+                 PipelineNodeDefinition('db-1', ['db'])], all_credentials, 'some_def')
+            environment_definition.launch(pipelined=pipelined)
+            return configurator.settings
+
+        normal_settings = settings_applied(False)
+        pipelined_settings = settings_applied(True)
+
+        self.assertEqual(sorted(normal_settings.keys()), sorted(pipelined_settings.keys()))
+        for applied, settings in pipelined_settings.items():
+            # Pipelined settings leave out services the service doesn't depend on
+            self.assertEqual(dict((name, normal_settings[applied][name]) for name in settings), settings)
+        self.assertEqual(['app-1', 'app-2'], pipelined_settings[('app', 'app-1')]['app'])
+        self.assertEqual(['db-1'], pipelined_settings[('app', 'app-2')]['db'])
+
+    def test_pipelined_launch_configures_nodes_without_waiting_for_slow_nodes_of_the_same_service(self):
+        configurator = RecordingServiceConfigurator(self.record_file())
+
+        self.launch_pipelined(configurator, PipelineNodeDefinition('app-1', ['app']),
+            PipelineNodeDefinition('app-2', ['app'], seconds_to_start=0.5))
+
+        events = configurator.recorded()
+        self.assertLess(events.index(['end', 'app', 'app-1']), events.index(['ready', '-', 'app-2']))
+
+    def test_pipelined_launch_configures_nodes_without_waiting_for_unrelated_slow_nodes(self):
+        configurator = RecordingServiceConfigurator(self.record_file())
+
+        self.launch_pipelined(configurator, PipelineNodeDefinition('db-1', ['db'], seconds_to_start=0.5),
+            PipelineNodeDefinition('cache-1', ['cache']))
+
+        events = configurator.recorded()
+        self.assertLess(events.index(['end', 'cache', 'cache-1']), events.index(['ready', '-', 'db-1']))
+
+    def test_pipelined_launch_configures_services_after_the_services_they_talk_to(self):
+        configurator = RecordingServiceConfigurator(self.record_file())
+
+        self.launch_pipelined(configurator, PipelineNodeDefinition('db-1', ['db'], seconds_to_start=0.3),
+            PipelineNodeDefinition('app-1', ['app']))
+
+        events = configurator.recorded()
+        self.assertLess(events.index(['end', 'db', 'db-1']), events.index(['start', 'app', 'app-1']))
+
+    def test_pipelined_launch_carries_on_with_other_nodes_when_one_fails(self):
+        configurator = RecordingServiceConfigurator(self.record_file())
+
+        with self.assertRaisesRegexp(StandardError, "Service app on node definition 2 .* Not run as"):
+            self.launch_pipelined(configurator, PipelineNodeDefinition('db-1', ['db'], starts=False),
+                PipelineNodeDefinition('app-1', ['app']), PipelineNodeDefinition('cache-1', ['cache']))
+
+        applied = [service for event, service, node in configurator.recorded() if event == 'end']
+        self.assertEqual(['cache'], applied)
+
+    def test_resumed_launch_should_skip_services_already_applied(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            journal_path = os.path.join(temp_dir, 'dev.journal')
+            record_file = os.path.join(temp_dir, 'record')
+
+            def environment(failing_services):
+                configurator = RecordingServiceConfigurator(record_file, failing_services=failing_services)
+                recording_service_definitions = dict((name, service_definition.ServiceDefinition(name,
+                    {'connectivity': [DynamicDictionary({'ports': [80]})]}, configurator, None)) for name in ['apache', 'my_app'])
+                return EnvironmentDefinition('dev', FileBackedNodeProvider(), recording_service_definitions,
+                    [SimpleNodeDefinition(services=['apache']), SimpleNodeDefinition(services=['my_app'])], all_credentials, 'some_def')
+
+            with self.assertRaises(StandardError):
+                environment(['my_app']).launch(journal=LaunchJournal(journal_path))
+            environment([]).launch(journal=LaunchJournal(journal_path, resume=True))
+
+            applied = [(event, service) for event, service, node_id in RecordingServiceConfigurator(record_file).recorded()]
+            self.assertEqual(1, applied.count(('start', 'apache')))
+            self.assertEqual(2, applied.count(('start', 'my_app')))
+            self.assertEqual(2, len(self.running_nodes()))
+            self.assertFalse(os.path.exists(journal_path))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_resumed_launch_should_reuse_nodes_started_but_not_tagged(self):
+        environment_definition = self.EnvironmentBuilder().with_nodes(SimpleNodeDefinition(services=['apache'])).build()
+        untagged_node = environment_definition.node_provider.start(FileBackedNodeDefinition(services=[]), 'dev', 'some_def')
+        environment_definition.journal.record(untagged_node.id(), launch_journal.PROVISIONED, definition=0, services=['apache'])
+
+        node_defs_to_provision, services_to_running_nodes, nodes_to_terminate = \
+            environment_definition.delta_defs_with_running_nodes(environment_definition.node_definitions)
+
+        self.assertEqual([], node_defs_to_provision)
+        self.assertEqual(set([untagged_node]), services_to_running_nodes['apache'])
+        self.assertEqual([], nodes_to_terminate)
+
+    def test_should_run_service_terminated_hooks_side_by_side_up_to_the_concurrency_limit(self):
+        hook = SlowTerminatedHook()
+        node_definitions = [SimpleNodeDefinition(services=['apache']) for _ in range(4)]
+        EnvironmentDefinition('dev', FileBackedNodeProvider(), service_definitions, node_definitions, all_credentials, 'some_def').launch()
+        environment_definition = EnvironmentDefinition('dev', ConcurrentFileBackedNodeProvider(), service_definitions, node_definitions,
+            all_credentials, 'some_def', {'apache': [hook]})
+
+        environment_definition.terminate_all()
+
+        self.assertEqual(2, hook.max_running)
+        self.assertEqual(4, len(hook.terminated))
+        self.assertEqual(4, len(self.terminated_nodes()))
+
     def test_can_skip_launching_node_if_node_already_has_service_running(self):
         environment_definition = self.EnvironmentBuilder().with_nodes(
             SimpleNodeDefinition(services=["apache"]),
@@ -138,6 +604,20 @@ class EnvironmentDefinitionTests(unittest.TestCase):
         self.assertIn('my_app', launched_services)
         self.assertIn('apache', launched_services)
 
+    def test_should_match_each_running_node_to_one_definition_at_most(self):
+        self.EnvironmentBuilder().with_nodes(SimpleNodeDefinition(services=['apache']),
+            SimpleNodeDefinition(services=['apache']), SimpleNodeDefinition(services=['apache'])).build().launch()
+        environment_definition = self.EnvironmentBuilder().with_nodes(SimpleNodeDefinition(services=['apache']),
+            SimpleNodeDefinition(services=['my_app']), SimpleNodeDefinition(services=['apache'])).build()
+
+        node_defs_to_provision, services_to_running_nodes, nodes_to_terminate = \
+            environment_definition.delta_defs_with_running_nodes(environment_definition.node_definitions)
+
+        self.assertEqual([environment_definition.node_definitions[1]], node_defs_to_provision)
+        self.assertEqual(2, len(services_to_running_nodes['apache']))
+        self.assertEqual(1, len(nodes_to_terminate))
+        self.assertNotIn(nodes_to_terminate[0], services_to_running_nodes['apache'])
+
     def test_can_launch_new_node_if_not_enough_nodes(self):
         environment_definition = self.EnvironmentBuilder().with_nodes(
             SimpleNodeDefinition(services=["apache"])).build()
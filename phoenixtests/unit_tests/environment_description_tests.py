@@ -0,0 +1,76 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import unittest
+from StringIO import StringIO
+from texttable import Texttable
+from phoenix import fabfile
+from phoenix.environment_description import EnvironmentDescription, Location, Node, TextTableEnvironmentDescriber, stream_table
+from phoenix.providers.address import Address
+from phoenixtests.unit_tests.stubs import StubNode
+
+class StreamTableTests(unittest.TestCase):
+
+    def test_should_draw_the_same_table_as_texttable(self):
+        rows = [['i-1', 'running', "a long value which has to wrap"], ['i-2', 'running', 'short']]
+        table = Texttable()
+        table.set_cols_width([5, 8, 10])
+        table.add_rows([['ID', 'State', 'Tags']] + rows)
+
+        self.assertEqual(table.draw(), "\n".join(stream_table(['ID', 'State', 'Tags'], rows, [5, 8, 10])))
+
+    def test_should_close_a_table_without_rows(self):
+        self.assertEqual(['+-------+', '|  ID   |', '+=======+', '+-------+'], list(stream_table(['ID'], [], [5])))
+
+    def test_should_draw_each_row_before_the_next_is_produced(self):
+        produced = []
+        def rows():
+            for node_id in ['i-1', 'i-2']:
+                produced.append(node_id)
+                yield [node_id]
+
+        lines = stream_table(['ID'], rows(), [5])
+        for _ in range(4):
+            next(lines)
+
+        self.assertEqual(['i-1'], produced)
+
+class IPAddressedStubNode(StubNode):
+    def address(self):
+        return Address('203.113.100.200', {})
+
+class NodeTableTests(unittest.TestCase):
+
+    def test_should_keep_instance_ids_and_ip_addresses_on_one_line(self):
+        output = StringIO()
+        sys.stdout = output
+        try:
+            fabfile._render_table([IPAddressedStubNode('i-0123456789abcdef0')])
+        finally:
+            sys.stdout = sys.__stdout__
+
+        self.assertIn('i-0123456789abcdef0', output.getvalue())
+        self.assertIn('203.113.100.200', output.getvalue())
+        self.assertTrue(all(len(line) <= 80 for line in output.getvalue().splitlines()))
+
+class TextTableEnvironmentDescriberTests(unittest.TestCase):
+
+    def test_should_describe_the_nodes_of_every_location(self):
+        node = Node({'dns_name': 'i-1.example.com', 'services': 'apache', 'id': 'i-1'})
+        description = TextTableEnvironmentDescriber().describe(EnvironmentDescription('prod', [Location('eu-west-1', [node])]))
+
+        self.assertTrue(description.startswith("\nEnvironment: prod\n+"))
+        self.assertIn("| eu-west-1  | i-1.example.com", description)
+        self.assertTrue(description.endswith("+"))
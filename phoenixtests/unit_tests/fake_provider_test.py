@@ -17,6 +17,7 @@ import unittest
 from nose.tools import istest
 import yaml
 from phoenix.providers import FileBackedNodeProvider
+from phoenix.providers.node_predicates import running_in_env
 from phoenix.service_definition import DynamicDictionary
 
 
@@ -67,6 +68,29 @@ class GivenAValidConfigurationFile(unittest.TestCase):
         fake_env = self.load_fake_env()
         self.assertDictEqual(fake_env[node.id()]['services']['test'], {8080:8080, 8081:8081})
 
+    def test_should_only_list_nodes_of_the_environment_asked_for(self):
+        fake_node_provider = FileBackedNodeProvider()
+        dev_node = fake_node_provider.start(NODE_DEFINITIONS['web_node'], 'dev', 'some_def')
+        fake_node_provider.start(NODE_DEFINITIONS['web_node'], 'uat', 'some_def')
+
+        self.assertEqual([dev_node], fake_node_provider.list(None, running_in_env('dev', 'some_def')))
+        self.assertEqual([dev_node.id()], self.load_fake_env_index()['some_def/dev'])
+
+    def test_should_list_nodes_started_before_the_file_had_an_index(self):
+        if not os.path.exists('./fake_nodes'):
+            os.makedirs('./fake_nodes')
+        with open('./fake_nodes/fake_env.yml', 'w') as f:
+            yaml.dump({'nodes': {1: {'state': 'running', 'services': {}, 'env': 'dev', 'env_def_name': 'some_def'}},
+                       'security_groups': []}, f)
+        fake_node_provider = FileBackedNodeProvider()
+        new_node = fake_node_provider.start(NODE_DEFINITIONS['web_node'], 'dev', 'some_def')
+
+        self.assertEqual(sorted([1, new_node.id()]), sorted([n.id() for n in fake_node_provider.list(None, running_in_env('dev', 'some_def'))]))
+
+    def load_fake_env_index(self):
+        with open('./fake_nodes/fake_env.yml', 'r') as f:
+            return yaml.load(f)['environments']
+
     def load_fake_env(self):
         f = open('./fake_nodes/fake_env.yml', 'r')
         fake_env = yaml.load(f)
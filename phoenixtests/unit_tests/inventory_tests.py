@@ -0,0 +1,164 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+from phoenix import service_definition
+from phoenix.configurators.fake_service_configurator import FakeServiceConfigurator
+from phoenix.environment_definition import EnvironmentDefinition
+from phoenix.fabfile import iter_running_nodes
+from phoenix.inventory import CachedNode, InventoryCache, describe_cached_environment
+from phoenix.providers import FileBackedNodeProvider
+from phoenix.providers.file_node_provider import FileBackedNodeDefinition
+from phoenix.service_definition import DynamicDictionary
+from phoenixtests.unit_tests.stubs import StubClock, StubNode
+
+service_definitions = {
+    'apache': service_definition.ServiceDefinition('apache', {'name': 'apache', 'connectivity': [DynamicDictionary({'ports': [80]})]}, FakeServiceConfigurator(), None)}
+
+class ListCountingProvider(FileBackedNodeProvider):
+    def __init__(self):
+        FileBackedNodeProvider.__init__(self)
+        self.list_calls = 0
+
+    def list(self, all_credentials, node_predicate):
+        self.list_calls += 1
+        return FileBackedNodeProvider.list(self, all_credentials, node_predicate)
+
+class ProgressRecordingProvider(FileBackedNodeProvider):
+    def __init__(self):
+        FileBackedNodeProvider.__init__(self)
+        self.finished_listing = False
+
+    def iter_nodes(self, all_credentials, node_predicate):
+        for node in FileBackedNodeProvider.iter_nodes(self, all_credentials, node_predicate):
+            yield node
+        self.finished_listing = True
+
+class InventorySnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tearDown()
+
+    def tearDown(self):
+        if os.path.exists('./fake_nodes'):
+            shutil.rmtree('./fake_nodes')
+
+    def environment(self, provider, number_of_nodes):
+        return EnvironmentDefinition('dev', provider, service_definitions,
+            [FileBackedNodeDefinition(services=['apache']) for _ in range(number_of_nodes)], {}, 'some_def')
+
+    def test_should_list_the_provider_once_for_a_whole_launch(self):
+        self.environment(FileBackedNodeProvider(), 2).launch()
+        provider = ListCountingProvider()
+        environment_definition = self.environment(provider, 3)
+
+        environment_definition.launch()
+        nodes = environment_definition.list_nodes()
+
+        self.assertEqual(1, provider.list_calls)
+        self.assertEqual(3, len(nodes))
+
+    def test_should_forget_nodes_once_they_are_shut_down(self):
+        self.environment(FileBackedNodeProvider(), 2).launch()
+        provider = ListCountingProvider()
+        environment_definition = self.environment(provider, 1)
+
+        environment_definition.launch()
+        environment_definition.terminate_all()
+
+        self.assertEqual([], environment_definition.list_nodes())
+        self.assertEqual(1, provider.list_calls)
+
+class InventoryCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.clock = StubClock()
+        self.provider = FileBackedNodeProvider()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def cache(self):
+        return InventoryCache(self.cache_dir, ttl=60, clock=self.clock)
+
+    def test_should_answer_from_the_cache_until_the_ttl_has_passed(self):
+        self.cache().put(self.provider, 'web_template', 'prod', [CachedNode(StubNode('i-1')), CachedNode(StubNode('i-2'))])
+
+        self.clock.now = 60
+        self.assertEqual(['i-1', 'i-2'], [node.id() for node in self.cache().get(self.provider, 'web_template', 'prod')])
+        self.assertEqual('i-1.example.com', self.cache().get(self.provider, 'web_template', 'prod')[0].address().get_dns_name())
+        self.assertIsNone(self.cache().get(self.provider, 'web_template', 'uat'))
+        self.clock.now = 61
+        self.assertIsNone(self.cache().get(self.provider, 'web_template', 'prod'))
+
+    def test_should_only_answer_for_the_scope_the_nodes_were_listed_in(self):
+        self.cache().put(self.provider, 'web_template', 'prod', [CachedNode(StubNode('i-1'))])
+
+        self.assertIsNone(self.cache().get(self.provider, 'web_template', 'prod', 'all regions'))
+        self.assertEqual(['i-1'], [node.id() for node in self.cache().get(self.provider, 'web_template', 'prod')])
+
+    def test_should_keep_the_cache_in_plain_yaml(self):
+        self.cache().put(self.provider, 'web_template', 'prod', [CachedNode(StubNode('i-1'), 'eu-west-1')])
+
+        with open(self.cache()._path(self.provider), 'r') as cache_file:
+            entries = yaml.safe_load(cache_file)
+
+        self.assertEqual([('prod', ['i-1'])], [(entry['env_name'], [node['id'] for node in entry['nodes']]) for entry in entries])
+
+    def test_should_forget_a_providers_environments_once_invalidated(self):
+        self.cache().put(self.provider, 'web_template', 'prod', [CachedNode(StubNode('i-1'))])
+
+        self.cache().invalidate(self.provider)
+
+        self.assertIsNone(self.cache().get(self.provider, 'web_template', 'prod'))
+
+    def test_should_describe_cached_nodes_in_the_locations_they_were_listed_in(self):
+        nodes = [CachedNode(StubNode('i-1'), 'eu-west-1'), CachedNode(StubNode('i-2'), 'us-east-1'), CachedNode(StubNode('i-3'), 'eu-west-1')]
+        self.cache().put(self.provider, 'web_template', 'prod', nodes)
+
+        description = describe_cached_environment('prod', self.cache().get(self.provider, 'web_template', 'prod'))
+
+        self.assertEqual([('eu-west-1', ['i-1', 'i-3']), ('us-east-1', ['i-2'])],
+            [(location.get_name(), [node.attributes()['id'] for node in location.get_nodes()]) for location in description.get_locations()])
+
+class RunningNodesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tearDown()
+        self.config_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if os.path.exists('./fake_nodes'):
+            shutil.rmtree('./fake_nodes')
+        if hasattr(self, 'config_dir'):
+            shutil.rmtree(self.config_dir)
+
+    def test_should_yield_nodes_of_the_running_environment_before_the_provider_has_listed_them_all(self):
+        provider = ProgressRecordingProvider()
+        environment_definition = EnvironmentDefinition('dev', provider, service_definitions,
+            [FileBackedNodeDefinition(services=['apache']) for _ in range(2)], {}, 'some_def')
+        environment_definition.launch()
+        provider.finished_listing = False
+
+        nodes = iter_running_nodes(self.config_dir, environment_definition, 'dev', 'some_def', fresh=True)
+
+        next(nodes)
+        self.assertFalse(provider.finished_listing)
+        self.assertEqual(1, len(list(nodes)))
+        self.assertTrue(provider.finished_listing)
@@ -0,0 +1,72 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from phoenix import launch_journal
+from phoenix.launch_journal import LaunchJournal, launch_journal_path
+
+class LaunchJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.path = launch_journal_path(self.config_dir, 'web_template', 'prod')
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+
+    def test_should_remember_completed_steps_when_resumed(self):
+        journal = LaunchJournal(self.path)
+        journal.record('i-1', launch_journal.PROVISIONED, definition=2, services=['apache', 'my_app'])
+        journal.record('i-1', launch_journal.APPLIED, 'apache')
+
+        resumed = LaunchJournal(self.path, resume=True)
+
+        self.assertTrue(resumed.completed('i-1', launch_journal.APPLIED, 'apache'))
+        self.assertFalse(resumed.completed('i-1', launch_journal.APPLIED, 'my_app'))
+        self.assertTrue(resumed.started_but_not_ready('i-1'))
+        self.assertEqual((2, ['apache', 'my_app']), resumed.provisioned_definition('i-1'))
+
+    def test_should_start_a_new_journal_unless_resuming(self):
+        LaunchJournal(self.path).record('i-1', launch_journal.READY)
+
+        self.assertFalse(LaunchJournal(self.path).completed('i-1', launch_journal.READY))
+
+    def test_should_ignore_an_entry_left_half_written(self):
+        LaunchJournal(self.path).record('i-1', launch_journal.READY)
+        with open(self.path, 'a') as journal_file:
+            journal_file.write("{node: i-2, step: [")
+
+        resumed = LaunchJournal(self.path, resume=True)
+
+        self.assertTrue(resumed.completed('i-1', launch_journal.READY))
+        self.assertFalse(resumed.completed('i-2', launch_journal.READY))
+
+    def test_should_remove_the_journal_once_the_launch_has_finished(self):
+        journal = LaunchJournal(self.path)
+        journal.record('i-1', launch_journal.READY)
+
+        journal.finish()
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_should_only_count_a_step_as_complete_with_the_checksum_it_was_recorded_with(self):
+        LaunchJournal(self.path).record('i-1', launch_journal.BUNDLE_UPLOADED, 'apache', checksum='abc')
+
+        resumed = LaunchJournal(self.path, resume=True)
+
+        self.assertTrue(resumed.completed('i-1', launch_journal.BUNDLE_UPLOADED, 'apache', 'abc'))
+        self.assertFalse(resumed.completed('i-1', launch_journal.BUNDLE_UPLOADED, 'apache', 'def'))
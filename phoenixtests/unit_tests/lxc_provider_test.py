@@ -16,7 +16,8 @@ import os
 import unittest
 from mockito.mocking import mock
 from mockito.mockito import when
-from phoenix.providers.lxc_provider import LXCNodeProvider, LXCNode
+from phoenix.providers.lxc_provider import LXCNodeProvider, LXCNode, listing_command
+from phoenix.providers.node_predicates import running_in_env
 import yaml
 from phoenix import fabfile
 
@@ -25,6 +26,15 @@ all_credentials = {
 }
 class LXCNodeProviderTests(unittest.TestCase):
 
+    def test_should_only_be_the_same_provider_for_the_same_host(self):
+        def provider(host_name):
+            return LXCNodeProvider(all_credentials['test'], host_name, ssh_command_helper=mock())
+
+        self.assertEqual(provider('lxc-1.example.com'), provider('lxc-1.example.com'))
+        self.assertEqual(hash(provider('lxc-1.example.com')), hash(provider('lxc-1.example.com')))
+        self.assertNotEqual(provider('lxc-1.example.com'), provider('lxc-2.example.com'))
+        self.assertNotEqual(hash(provider('lxc-1.example.com')), hash(provider('lxc-2.example.com')))
+
     def test_will_parse_LXC_node_environment_configuration(self):
         single_service_yaml = """
                 prod:
@@ -180,7 +190,7 @@ class LXCNodeProviderTests(unittest.TestCase):
 
     def test_should_return_empty_running_environment_if_nothing_is_running(self):
         mock_command_helper = mock()
-        when(mock_command_helper).run_command("sudo lxc-ls -c1").thenReturn("")
+        when(mock_command_helper).run_command(listing_command(running_in_env("test", "test").conditions)).thenReturn("")
         provider = LXCNodeProvider(None, None, mock_command_helper)
         environment = provider.get_running_environment("test", "test", all_credentials)
         self.assertIsNotNone(environment)
@@ -202,11 +212,8 @@ class LXCNodeProviderTests(unittest.TestCase):
                 'env_name' : 'test'
                 'env_def_name' : 'Single-AZ Deployment'
                 """
-        when(mock_command_helper).run_command("sudo lxc-ls -c1").thenReturn("123\n124")
-        when(mock_command_helper).run_command("if sudo [ -f /var/lib/lxc/123/tags ]; then sudo cat /var/lib/lxc/123/tags; else echo '{}'; fi").thenReturn(tags1)
-        when(mock_command_helper).run_command("if sudo [ -f /var/lib/lxc/124/tags ]; then sudo cat /var/lib/lxc/124/tags; else echo '{}'; fi").thenReturn(tags2)
-        when(mock_command_helper).run_command("sudo lxc-info -n 123").thenReturn("state: RUNNING")
-        when(mock_command_helper).run_command("sudo lxc-info -n 124").thenReturn("state: RUNNING")
+        when(mock_command_helper).run_command(listing_command(running_in_env("test", "Single-AZ Deployment").conditions)).thenReturn(
+            "=== 123 running%s\n=== 124 running%s" % (tags1, tags2))
 
         provider = LXCNodeProvider(all_credentials, 'test_host', mock_command_helper)
         environment = provider.get_running_environment("test", "Single-AZ Deployment", all_credentials)
@@ -242,4 +249,22 @@ class LXCNodeProviderTests(unittest.TestCase):
 
         when(mock_command_helper).run_command_silently("ping -c1 123").thenReturn(mock_string_attr)
         with self.assertRaisesRegexp(Exception, "Node 123 is not running"):
-            lxc_node.wait_for_ready(lambda : None, 5)
\ No newline at end of file
+            lxc_node.wait_for_ready(lambda : None, 5)
+
+    def test_should_have_the_host_skip_containers_in_other_environments(self):
+        command = listing_command(running_in_env("test", "Single-AZ Deployment").conditions)
+
+        self.assertIn("grep -qiE '^state: *(running)$' || continue", command)
+        self.assertIn("sudo grep -qF 'Single-AZ Deployment' /var/lib/lxc/$c/tags 2>/dev/null || continue", command)
+        self.assertIn("sudo grep -qF test /var/lib/lxc/$c/tags 2>/dev/null || continue", command)
+
+    def test_should_only_list_nodes_matching_the_predicate(self):
+        mock_command_helper = mock()
+        when(mock_command_helper).run_command(listing_command(running_in_env("test", "web").conditions)).thenReturn(
+            "=== 123 running\n{env_name: test, env_def_name: web, services: {}}\n" +
+            "=== 124 running\n{env_name: test_2, env_def_name: web, services: {}}\n")
+
+        nodes = LXCNodeProvider(all_credentials, 'test_host', mock_command_helper).list(all_credentials, running_in_env("test", "web"))
+
+        self.assertEqual(['123'], [node.id() for node in nodes])
+        self.assertEqual('running', nodes[0].state())
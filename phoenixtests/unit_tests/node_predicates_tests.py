@@ -0,0 +1,40 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from phoenix.providers.node_predicates import NodePredicate, all_nodes, conditions_of, running_in_env, running_nodes
+from phoenixtests.unit_tests.stubs import StubNode
+
+class NodePredicateTests(unittest.TestCase):
+
+    def test_should_only_match_nodes_meeting_every_condition(self):
+        predicate = running_in_env('prod', 'web_template')
+
+        self.assertTrue(predicate(StubNode()))
+        self.assertFalse(predicate(StubNode(env_name='uat')))
+        self.assertFalse(predicate(StubNode(state='stopped')))
+        self.assertTrue(all_nodes(StubNode(env_name='uat', env_def_name='db_template', state='stopped')))
+
+    def test_should_combine_conditions_on_the_same_attribute(self):
+        combined = NodePredicate(state=['running', 'pending'], environment_name=['prod']) & running_nodes
+
+        self.assertEqual(NodePredicate(state=['running'], environment_name=['prod']), combined)
+
+    def test_should_only_look_inside_node_predicates(self):
+        self.assertEqual({'state': frozenset(['running'])}, conditions_of(running_nodes))
+        self.assertIsNone(conditions_of(lambda node: True))
+
+    def test_should_refuse_conditions_on_attributes_which_cannot_be_filtered_on(self):
+        with self.assertRaisesRegexp(StandardError, "Nodes can't be filtered on ami_id"):
+            NodePredicate(ami_id=['ami-1'])
@@ -32,6 +32,10 @@ class NoopProviderTests(unittest.TestCase):
         self.sut.shutdown(None)
         verifyZeroInteractions(self.inner_provider)
 
+    def test_should_not_check_node_definitions_with_the_inner_provider(self):
+        self.sut.check_node_definitions([self.node_definition])
+        verifyZeroInteractions(self.inner_provider)
+
     def test_should_add_actions_to_noop_list_for_state_changing_events(self):
         self.sut.start(self.node_definition, "env_name", "env_def_name")
         self.sut.shutdown("node_id")
@@ -47,7 +51,7 @@ class NoopProviderTests(unittest.TestCase):
 
     def test_should_capture_actions_on_returned_nodes_from_list(self):
         node = create_node()
-        when(self.inner_provider).list('cred', node_predicates.all_nodes).thenReturn([node])
+        when(self.inner_provider).iter_nodes('cred', node_predicates.all_nodes).thenReturn([node])
 
         new_node = self.sut.list('cred')[0]
         new_node.run_command("do something")
@@ -57,14 +61,14 @@ class NoopProviderTests(unittest.TestCase):
 
     def test_should_return_new_nodes_in_list_function(self):
         existing_node = create_node()
-        when(self.inner_provider).list('cred', node_predicates.all_nodes).thenReturn([existing_node])
+        when(self.inner_provider).iter_nodes('cred', node_predicates.all_nodes).thenReturn([existing_node])
         new_node = self.sut.start(None,None,None)
         nodes = self.sut.list('cred')
         self.assertIn(new_node, nodes)
 
     def test_should_not_return_terminated_nodes(self):
         existing_node = create_node()
-        when(self.inner_provider).list('cred', node_predicates.all_nodes).thenReturn([existing_node])
+        when(self.inner_provider).iter_nodes('cred', node_predicates.all_nodes).thenReturn([existing_node])
         self.sut.shutdown("id")
         nodes = self.sut.list('cred')
         self.assertEqual(0, len(nodes))
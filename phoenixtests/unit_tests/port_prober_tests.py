@@ -0,0 +1,64 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import threading
+import unittest
+from phoenix.utilities.port_prober import PortProber
+from phoenix.utilities.worker_pool import WorkerPool
+
+def unused_port():
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+def listen(port):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(5)
+    return listener
+
+class PortProberTests(unittest.TestCase):
+
+    def test_should_report_ports_which_are_already_open(self):
+        listeners = [listen(unused_port()) for _ in range(3)]
+        try:
+            prober = PortProber(min_interval=0.05)
+
+            outcomes = WorkerPool(3).map(lambda l: prober.wait_until_open('127.0.0.1', l.getsockname()[1], 2), listeners)
+
+            self.assertEqual([True] * 3, [outcome.result for outcome in outcomes])
+        finally:
+            map(lambda l: l.close(), listeners)
+
+    def test_should_keep_trying_until_the_port_opens(self):
+        port = unused_port()
+        listeners = []
+        opener = threading.Timer(0.3, lambda: listeners.append(listen(port)))
+        opener.start()
+        try:
+            self.assertTrue(PortProber(min_interval=0.05, max_interval=0.1).wait_until_open('127.0.0.1', port, 3))
+        finally:
+            opener.join()
+            map(lambda l: l.close(), listeners)
+
+    def test_should_give_up_once_the_timeout_has_passed(self):
+        prober = PortProber(min_interval=0.05)
+
+        self.assertFalse(prober.wait_until_open('127.0.0.1', unused_port(), 0.3))
+        # Nobody is waiting on the port any more, so it isn't tried again
+        self.assertEqual({}, prober.targets)
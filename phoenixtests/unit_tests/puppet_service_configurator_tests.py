@@ -12,13 +12,74 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
 import os
+import tempfile
 import unittest
-from phoenix.configurators.puppet_service_configurator import PuppetServiceConfigurator
+from phoenix.configurators.puppet_service_configurator import PuppetServiceConfigurator, ConfigureService
+from phoenix.launch_journal import LaunchJournal
 import yaml
 
+class StubBundlingServiceDefinition:
+    name = 'apache'
+    puppet_module_directory = 'puppet'
+    puppet_manifest = 'apache.pp'
+
+    def __init__(self, contents='class apache {}'):
+        self.contents = contents
+
+    def bundle(self, attribute, bundle_name):
+        tar_file = tempfile.mkstemp(suffix=bundle_name)[1]
+        bundle = gzip.open(tar_file, 'wb')
+        bundle.write(self.contents)
+        bundle.close()
+        return tar_file
+
+class StubUploadNode:
+    def __init__(self):
+        self.uploaded = []
+
+    def id(self):
+        return 'i-1'
+
+    def upload_file(self, file_name, destination='.'):
+        self.uploaded.append(file_name)
+
+    def run_command(self, command, warn_only=False):
+        return "install ok installed"
+
 class PuppetServiceConfiguratorTests(unittest.TestCase):
 
+    def configure(self, node, journal, contents='class apache {}'):
+        ConfigureService(node, StubBundlingServiceDefinition(contents), {'settings': {}}, journal).configure()
+
+    def test_should_remove_the_local_bundle_once_uploaded(self):
+        node = StubUploadNode()
+
+        self.configure(node, LaunchJournal())
+
+        self.assertEqual(1, len(node.uploaded))
+        self.assertFalse(os.path.exists(node.uploaded[0]))
+
+    def test_should_upload_the_bundle_again_when_resumed_with_changed_puppet_code(self):
+        journal = LaunchJournal()
+        node = StubUploadNode()
+
+        self.configure(node, journal)
+        self.configure(node, journal)
+        self.assertEqual(1, len(node.uploaded))
+
+        self.configure(node, journal, 'class apache { fixed }')
+        self.assertEqual(2, len(node.uploaded))
+
+    def test_should_upload_the_bundle_every_time_without_a_journal(self):
+        node = StubUploadNode()
+
+        self.configure(node, None)
+        self.configure(node, None)
+
+        self.assertEqual(2, len(node.uploaded))
+
     def test_will_parse_puppet_service_configuration(self):
         single_service_yaml = """
             apache:
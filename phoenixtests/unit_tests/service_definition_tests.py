@@ -19,7 +19,7 @@ import tarfile
 from mockito.inorder import verify
 from mockito.mocking import mock
 from mockito.mockito import when
-from phoenix.service_definition import service_definitions_from_yaml
+from phoenix.service_definition import service_definitions_from_yaml, service_dependencies
 from phoenix.providers.address import Address
 
 class ServiceDefinitionTests(unittest.TestCase):
@@ -127,3 +127,23 @@ class ServiceDefinitionTests(unittest.TestCase):
         with self.assertRaisesRegexp(Exception,
             "Key 'puppet_module_directory' is not defined in services configuration of service: 'apache',\nKey 'puppet_manifest' is not defined in services configuration of service: 'mongo'"):
             service_definitions_from_yaml(multiple_service_yaml, os.path.abspath('samples'))
+
+    def test_services_depend_on_the_services_which_allow_them_in(self):
+        services_yaml = """
+          hello_world:
+                service_configurator: phoenix.configurators.fake_service_configurator.FakeServiceConfigurator
+                connectivity:
+                    - protocol: tcp
+                      ports: [ 8080 ]
+                      allowed: [ WORLD ]
+          mongo:
+                service_configurator: phoenix.configurators.fake_service_configurator.FakeServiceConfigurator
+                connectivity:
+                    - protocol: tcp
+                      ports: [ 27017 ]
+                      allowed: [ hello_world, 10.0.0.0/8 ]
+        """
+
+        dependencies = service_dependencies(service_definitions_from_yaml(services_yaml, None))
+
+        self.assertEqual({'hello_world': set(['mongo']), 'mongo': set()}, dependencies)
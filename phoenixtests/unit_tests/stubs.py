@@ -0,0 +1,72 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from phoenix.providers.address import Address
+
+class StubClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class StubNode:
+    def __init__(self, node_id=None, env_name='prod', env_def_name='web_template', state='running'):
+        self.node_id = node_id
+        self.env_name = env_name
+        self.env_def_name = env_def_name
+        self.node_state = state
+
+    def id(self):
+        return self.node_id
+
+    def state(self):
+        return self.node_state
+
+    def tags(self):
+        return {'env_name': self.env_name}
+
+    def environment_name(self):
+        return self.env_name
+
+    def environment_definition_name(self):
+        return self.env_def_name
+
+    def address(self):
+        return Address('%s.example.com' % self.node_id, {})
+
+    def attributes(self):
+        return {'id': self.node_id, 'dns_name': '%s.example.com' % self.node_id, 'services': {}}
+
+class Rendezvous:
+    """
+    Only lets callers through once expected of them have arrived, so a test can tell calls were made side by side
+    without timing them
+    """
+    def __init__(self, expected):
+        self.expected = expected
+        self.arrived = 0
+        self.lock = threading.Lock()
+        self.everyone_arrived = threading.Event()
+
+    def arrive(self, timeout=2):
+        """
+        returns: whether everyone arrived within timeout seconds
+        """
+        with self.lock:
+            self.arrived += 1
+            if self.arrived >= self.expected:
+                self.everyone_arrived.set()
+        return self.everyone_arrived.wait(timeout)
@@ -0,0 +1,122 @@
+# Copyright 2012 ThoughtWorks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import unittest
+from phoenix.utilities.worker_pool import WorkerPool, call_in_subprocess, fabric_env_lock, find_cycle
+
+class WorkerPoolTests(unittest.TestCase):
+
+    def test_should_return_outcomes_in_the_order_of_the_items(self):
+        def slow_double(x):
+            time.sleep(0.05 * (3 - x))
+            return x * 2
+
+        outcomes = WorkerPool(3).map(slow_double, [0, 1, 2])
+
+        self.assertEqual([0, 2, 4], [o.result for o in outcomes])
+
+    def test_should_never_run_more_than_max_workers_at_once(self):
+        lock = threading.Lock()
+        counts = {'running': 0, 'max': 0}
+
+        def task(x):
+            with lock:
+                counts['running'] += 1
+                counts['max'] = max(counts['max'], counts['running'])
+            time.sleep(0.05)
+            with lock:
+                counts['running'] -= 1
+
+        WorkerPool(2).map(task, range(6))
+
+        self.assertEqual(2, counts['max'])
+
+    def test_should_run_in_calling_thread_with_a_single_worker(self):
+        threads = WorkerPool(1).map(lambda x: threading.current_thread(), [1, 2])
+
+        self.assertEqual([threading.current_thread()] * 2, [o.result for o in threads])
+
+    def test_should_capture_errors_without_stopping_other_tasks(self):
+        def task(x):
+            if x == 1:
+                raise StandardError("boom")
+            return x
+
+        outcomes = WorkerPool(2).map(task, [0, 1, 2])
+
+        self.assertTrue(outcomes[0].succeeded())
+        self.assertEqual("boom", str(outcomes[1].error))
+        self.assertEqual(2, outcomes[2].result)
+
+    def test_should_only_start_task_once_its_dependencies_have_completed(self):
+        order = []
+        tasks = [(key, lambda key=key: order.append(key)) for key in ['app', 'db', 'cache']]
+
+        WorkerPool(3).run(tasks, {'app': ['db', 'cache'], 'cache': ['db']})
+
+        self.assertEqual(['db', 'cache', 'app'], order)
+
+    def test_should_not_run_dependents_of_a_failed_task(self):
+        order = []
+        def fail():
+            raise StandardError("db failed")
+
+        outcomes = WorkerPool(2).run([('db', fail), ('app', lambda: order.append('app')), ('web', lambda: order.append('web'))],
+            {'app': ['db'], 'web': ['app']})
+
+        self.assertEqual([], order)
+        self.assertFalse(outcomes['app'].succeeded())
+        self.assertFalse(outcomes['web'].succeeded())
+
+    def test_should_refuse_to_run_tasks_with_cyclic_dependencies(self):
+        with self.assertRaisesRegexp(StandardError, "Dependency cycle detected: a -> b -> a"):
+            WorkerPool(2).run([('a', lambda: None), ('b', lambda: None)], {'a': ['b'], 'b': ['a']})
+
+    def test_should_find_no_cycle_in_acyclic_dependencies(self):
+        self.assertIsNone(find_cycle(['a', 'b', 'c'], {'a': ['b', 'c'], 'b': ['c']}))
+
+class CallInSubprocessTests(unittest.TestCase):
+
+    def test_should_not_hang_when_forking_while_another_thread_holds_the_fabric_env_lock(self):
+        holding = threading.Event()
+        def hold_lock():
+            with fabric_env_lock:
+                holding.set()
+                time.sleep(0.3)
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        holding.wait()
+
+        def take_lock():
+            with fabric_env_lock:
+                pass
+        caller = threading.Thread(target=call_in_subprocess, args=(take_lock,))
+        caller.daemon = True
+        caller.start()
+        caller.join(5)
+        holder.join()
+
+        self.assertFalse(caller.is_alive())
+
+    def test_should_return_the_result_of_the_call(self):
+        self.assertEqual([1, 2], call_in_subprocess(lambda: [1, 2]))
+
+    def test_should_raise_the_error_of_the_call(self):
+        def fail():
+            raise StandardError("boom")
+
+        with self.assertRaisesRegexp(StandardError, "boom"):
+            call_in_subprocess(fail)